@@ -18,6 +18,7 @@ import pandas as pd
 
 # additional packages
 from getdata import getData
+from binaryTable import loadTable
 from statsmodels.formula.api import ols
 from statsmodels.stats.anova import anova_lm
 
@@ -77,7 +78,7 @@ def show_teqf():
     """Shows the equivalence of t-test and f-test, for comparing two groups"""
     
     # Get the data
-    data = pd.read_csv(r'..\Data\data_kaplan\galton.csv')
+    data = loadTable('galton.csv', subDir=r'..\Data\data_kaplan')
     
     # First, calculate the F- and the T-values, ...
     F_statistic, pVal = stats.f_oneway(data['father'], data['mother'])
@@ -98,7 +99,7 @@ def anova_statsmodels():
     ''' do the ANOVA with a function '''
     
     # Get the data
-    data = pd.read_csv(r'..\Data\data_kaplan\galton.csv')
+    data = loadTable('galton.csv', subDir=r'..\Data\data_kaplan')
     
     anova_results = anova_lm(ols('height ~ 1 + sex', data).fit())
     print('\nANOVA with "statsmodels" ------------------------------')
@@ -20,11 +20,12 @@ import pandas as pd
 import os
 
 # additional packages
+from binaryTable import loadTable
 from statsmodels.formula.api import ols
 from statsmodels.stats.anova import anova_lm
 
 # Get the data
-data = pd.read_csv(r'..\Data\data_kaplan\galton.csv')
+data = loadTable('galton.csv', subDir=r'..\Data\data_kaplan')
 
 # First, calculate the F- and the T-values, ...
 F_statistic, pVal = stats.f_oneway(data['father'], data['mother'])
@@ -0,0 +1,275 @@
+'''Memory-mapped loading of large numeric tables.
+
+A CSV-file is converted only once, chunk by chunk, into one raw binary file
+per column, with a fixed width per value:
+- numbers are stored as int64/float64 (NaN for missing values), and booleans
+  as bool;
+- text columns are stored as int32 codes into a list of categories (-1 for
+  missing values), like a pandas Categorical.
+
+The binary files and a "table.json" with the names, dtypes and categories of
+the columns are kept in a directory in "__npycache__" next to the file (see
+getdata.py), whose name contains a key of the path, size and modification
+time of the file. Later calls only map the columns into memory, so that
+statistics can be calculated on slices of tables that do not fit into RAM.
+'''
+
+# Linked to text in: An Introduction to Statistics
+
+# Import standard packages
+import numpy as np
+import pandas as pd
+import json
+import os
+import shutil
+import zlib
+
+# additional packages
+from os.path import join
+
+import dataRegistry
+from getdata import cachePath
+
+META_FILE = 'table.json'
+CHUNK_SIZE = 1 << 20
+
+def loadTable(inFile, subDir=r'..\Data', asFrame=True, allowNetwork=None,
+              chunkSize=CHUNK_SIZE, **kwargs):
+    '''Columns of a CSV-file, as read-only np.memmap arrays
+
+    With "asFrame", a DataFrame is returned: its numeric columns are
+    read-only views of the memory-mapped files, and its text columns are
+    Categoricals (with the categories sorted, as by pd.read_csv). Otherwise,
+    a dictionary name -> np.memmap is returned, with the codes of the text
+    columns in "table.codes" and their categories in "table.categories".
+
+    Additional keyword arguments are passed on to pd.read_csv. Files of the
+    data registry are found like in getData.'''
+    fullInFile = dataRegistry.locate(inFile, subDir, allowNetwork)
+    if not os.path.isfile(fullInFile):
+        raise IOError(fullInFile + ' does not exist')
+    tableDir = _convertedTable(fullInFile, chunkSize, kwargs)
+    with open(join(tableDir, META_FILE)) as fh:
+        meta = json.load(fh)
+
+    nRows = meta['nRows']
+    columns = {}
+    categories = {}
+    for ii, column in enumerate(meta['columns']):
+        fileName = join(tableDir, '{0}.bin'.format(ii))
+        if nRows == 0:
+            # files without content cannot be memory-mapped
+            values = np.empty(0, dtype=column['dtype'])
+        else:
+            values = np.memmap(fileName, dtype=column['dtype'], mode='r',
+                               shape=(nRows,))
+        columns[column['name']] = values
+        if 'categories' in column:
+            categories[column['name']] = column['categories']
+
+    if not asFrame:
+        return Table(columns, categories)
+
+    data = {}
+    for name, values in columns.items():
+        if name in categories:
+            values = pd.Categorical.from_codes(values, categories[name])
+        data[name] = values
+    return pd.DataFrame(data, columns=list(columns), copy=False)
+
+class Table(dict):
+    '''Memory-mapped columns, name -> np.memmap, with text columns as codes'''
+
+    def __init__(self, columns, categories):
+        dict.__init__(self, columns)
+        self.categories = categories
+
+    def codes(self, name):
+        '''Integer codes of a text column, -1 for missing values'''
+        return self[name]
+
+    def values(self, name, rows=slice(None)):
+        '''Values of some rows of a column, with text columns decoded'''
+        if name not in self.categories:
+            return np.asarray(self[name][rows])
+        return np.asarray(pd.Categorical.from_codes(self[name][rows],
+                                                    self.categories[name]))
+
+def _convertedTable(fullInFile, chunkSize, options):
+    '''Directory with the binary columns of "fullInFile", converted if necessary'''
+    cacheDir, name = cachePath(fullInFile)
+    # the options of pd.read_csv change the table, so they are part of the key
+    optionKey = json.dumps(options, sort_keys=True, default=str)
+    name = '{0}.{1:08x}.cols'.format(name[:-len('.npy')],
+                                     _crc(optionKey) if options else 0)
+    tableDir = join(cacheDir, name)
+    if os.path.isfile(join(tableDir, META_FILE)):
+        return tableDir
+
+    # remove the tables of previous versions of the file; tables of the
+    # current version with other options of pd.read_csv are kept
+    prefix = os.path.basename(fullInFile) + '.'
+    versionKey = name[len(prefix):].split('.')[0]
+    if os.path.isdir(cacheDir):
+        for oldName in os.listdir(cacheDir):
+            if not (oldName.startswith(prefix) and oldName.endswith('.cols')):
+                continue
+            fields = oldName[len(prefix):].split('.')
+            if len(fields) == 3 and fields[0] != versionKey:
+                shutil.rmtree(join(cacheDir, oldName), ignore_errors=True)
+
+    # convert into a temporary directory first, so that other processes never
+    # see a partially written table
+    tmpDir = '{0}.{1}.tmp'.format(tableDir, os.getpid())
+    if os.path.isdir(tmpDir):
+        shutil.rmtree(tmpDir)
+    os.makedirs(tmpDir)
+    try:
+        _convert(fullInFile, tmpDir, chunkSize, options)
+        os.replace(tmpDir, tableDir)
+    except OSError:
+        shutil.rmtree(tmpDir, ignore_errors=True)
+        if not os.path.isfile(join(tableDir, META_FILE)):
+            raise
+        # another process has been faster
+    except:
+        shutil.rmtree(tmpDir, ignore_errors=True)
+        raise
+    return tableDir
+
+def _crc(text):
+    '''CRC-32 of a string'''
+    return zlib.crc32(text.encode('utf-8')) & 0xffffffff
+
+def _convert(fullInFile, tableDir, chunkSize, options):
+    '''Write the columns of a CSV-file as raw binary files, chunk by chunk
+
+    The dtype of a column is taken from the first chunk, and promoted when a
+    later chunk needs it (e.g. int64 -> float64 for missing values). Columns
+    that turn out to contain text are converted again, as text.'''
+    textColumns = set()
+    while True:
+        readOptions = dict(options)
+        if textColumns:
+            dtypes = dict(readOptions.get('dtype') or {})
+            dtypes.update((name, str) for name in textColumns)
+            readOptions['dtype'] = dtypes
+        try:
+            columns, nRows = _writeColumns(fullInFile, tableDir, chunkSize,
+                                           readOptions, textColumns)
+            break
+        except _TextColumn as err:
+            textColumns.add(err.args[0])
+
+    for ii, column in enumerate(columns):
+        if 'categories' in column:
+            _sortCategories(join(tableDir, '{0}.bin'.format(ii)), nRows, column,
+                            chunkSize)
+
+    meta = {'file': os.path.basename(fullInFile), 'nRows': nRows,
+            'columns': columns}
+    with open(join(tableDir, META_FILE), 'w') as fh:
+        json.dump(meta, fh, indent=1)
+
+class _TextColumn(Exception):
+    '''A numeric column contains text in a later chunk'''
+
+def _writeColumns(fullInFile, tableDir, chunkSize, options, textColumns):
+    '''One pass through the file; returns the description of the columns'''
+    columns = None
+    lookups = []
+    nRows = 0
+    for chunk in pd.read_csv(fullInFile, chunksize=chunkSize, **options):
+        if columns is None:
+            columns = []
+            for name in chunk.columns:
+                columns.append({'name': str(name), 'dtype': None})
+                lookups.append(None)
+            for ii in range(len(columns)):
+                open(join(tableDir, '{0}.bin'.format(ii)), 'wb').close()
+
+        for ii, name in enumerate(chunk.columns):
+            fileName = join(tableDir, '{0}.bin'.format(ii))
+            column = columns[ii]
+            values = chunk[name]
+            kind = 'text' if name in textColumns else _kind(values)
+            if kind == 'text' and lookups[ii] is None:
+                if column['dtype'] is not None:
+                    raise _TextColumn(name)
+                lookups[ii] = {}
+                column['dtype'] = 'int32'
+                column['categories'] = []
+            if lookups[ii] is not None:
+                # numbers in a text column are kept as text, too
+                values = _encode(values, lookups[ii], column['categories'])
+            else:
+                dtype = np.dtype(kind)
+                if column['dtype'] is not None:
+                    old = np.dtype(column['dtype'])
+                    dtype = np.promote_types(old, dtype)
+                    if dtype != old:
+                        _promote(fileName, nRows, old, dtype)
+                column['dtype'] = dtype.name
+                values = values.to_numpy(dtype=dtype)
+            with open(fileName, 'ab') as fh:
+                np.ascontiguousarray(values).tofile(fh)
+        nRows += len(chunk)
+
+    if columns is None:
+        columns = []
+    for column in columns:
+        if column['dtype'] is None:
+            column['dtype'] = 'float64'
+    return columns, nRows
+
+def _kind(values):
+    '''Fixed-width dtype for a column of a chunk, or "text"'''
+    if pd.api.types.is_bool_dtype(values.dtype):
+        return 'bool'
+    if pd.api.types.is_integer_dtype(values.dtype):
+        return 'int64'
+    if pd.api.types.is_float_dtype(values.dtype):
+        return 'float64'
+    if values.isna().all():
+        # a chunk without any value: NaN
+        return 'float64'
+    return 'text'
+
+def _encode(values, lookup, categories):
+    '''int32 codes of text values; new values are appended to the categories'''
+    chunkCodes, uniques = pd.factorize(values)
+    mapping = np.empty(len(uniques) + 1, dtype=np.int32)
+    mapping[-1] = -1    # missing values have the code -1 in both
+    for ii, value in enumerate(uniques):
+        value = str(value)
+        code = lookup.get(value)
+        if code is None:
+            code = lookup[value] = len(categories)
+            categories.append(value)
+        mapping[ii] = code
+    return mapping[chunkCodes]
+
+def _sortCategories(fileName, nRows, column, chunkSize):
+    '''Sort the categories of a text column, and renumber its codes in place'''
+    categories = column['categories']
+    order = sorted(range(len(categories)), key=categories.__getitem__)
+    newCodes = np.empty(len(categories) + 1, dtype=np.int32)
+    newCodes[order] = np.arange(len(categories))
+    newCodes[-1] = -1
+    column['categories'] = [categories[ii] for ii in order]
+    if nRows == 0 or order == list(range(len(categories))):
+        return
+    codes = np.memmap(fileName, dtype=np.int32, mode='r+', shape=(nRows,))
+    for start in range(0, nRows, chunkSize):
+        codes[start:start + chunkSize] = newCodes[codes[start:start + chunkSize]]
+    codes.flush()
+    del codes
+
+def _promote(fileName, nRows, old, new):
+    '''Rewrite the values written so far with a wider dtype'''
+    values = np.fromfile(fileName, dtype=old, count=nRows)
+    values.astype(new).tofile(fileName)
+
+if __name__ == '__main__':
+    data = loadTable('galton.csv', subDir=r'..\Data\data_kaplan')
+    print(data.groupby('sex', observed=True)['height'].mean())
@@ -0,0 +1,397 @@
+'''Local registry of the data sets used by the Python programs for statistics.
+
+The manifest "Data/registry.json" lists every data file with its relative
+path, SHA-256 hash, format, parser options, and the URL it can be fetched
+from. Files are always taken from the local "Data" directory, after their
+hash has been checked (for text files, with CRLF line ends counted as LF).
+Downloads are stored in "Data/downloads", and never replace files under
+version control. The network is used only if this is explicitly
+enabled, with the argument "allowNetwork=True" or with the environment
+variable STATSINTRO_NETWORK=1, so that machines without access to the
+internet fail immediately instead of waiting for a socket timeout.
+
+Usage from the command line:
+
+    python dataRegistry.py build     (re)write the manifest for Data/
+    python dataRegistry.py fetch     download missing or corrupt files
+    python dataRegistry.py verify    check the hashes of all local files
+'''
+
+# Linked to text in: An Introduction to Statistics
+
+# Import standard packages
+import hashlib
+import json
+import os
+import sys
+
+if sys.version_info[0] == 3:
+    from urllib.request import urlopen
+    from urllib.parse import quote
+else:
+    from urllib2 import urlopen
+    from urllib import quote
+
+DATA_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'Data'))
+MANIFEST = os.path.join(DATA_DIR, 'registry.json')
+URL_BASE = 'https://raw.github.com/thomas-haslwanter/statsintro/master/Data/'
+NETWORK_VARIABLE = 'STATSINTRO_NETWORK'
+TIMEOUT = 30
+
+# Data that are not part of the repository, but downloaded into "Data/downloads".
+# Entries without a hash are trusted on their first download; the hash of
+# that download is then recorded in "Data/downloads/hashes.json" (which, like
+# the downloads, is not under version control), and checked from then on.
+REMOTE = [
+    {'name': 'GLM_data.zip',
+     'path': 'downloads/GLM_data.zip',
+     'url': 'http://cdn.crcpress.com/downloads/C9500/GLM_data.zip',
+     'sha256': None,
+     'format': 'zip',
+     'parser': {}},
+]
+
+# Directories and files in DATA_DIR that are not data sets
+IGNORE = {'__npycache__', 'downloads', os.path.basename(MANIFEST)}
+
+# Hashes of local files that have been verified, keyed by (path, size, mtime)
+_verified = {}
+
+
+class DataNotAvailable(IOError):
+    '''A registered file is neither available locally, nor can be fetched'''
+
+
+def networkAllowed(allowNetwork=None):
+    '''Explicit argument, or else the environment variable STATSINTRO_NETWORK'''
+    if allowNetwork is not None:
+        return allowNetwork
+    return os.environ.get(NETWORK_VARIABLE, '0').lower() in ('1', 'true', 'yes')
+
+
+def loadManifest(manifest=None):
+    '''Entries of the registry, as a dictionary name -> entry'''
+    if manifest is None:
+        manifest = MANIFEST
+    try:
+        with open(manifest) as fh:
+            entries = json.load(fh)['datasets']
+    except IOError:
+        entries = []
+    registry = dict((entry['name'], entry) for entry in REMOTE)
+    registry.update((entry['name'], entry) for entry in entries)
+    return registry
+
+
+def saveManifest(registry, manifest=None):
+    '''Write the registry, sorted by name'''
+    if manifest is None:
+        manifest = MANIFEST
+    entries = [registry[name] for name in sorted(registry)]
+    tmpFile = manifest + '.tmp'
+    with open(tmpFile, 'w') as fh:
+        json.dump({'datasets': entries}, fh, indent=1, sort_keys=True)
+        fh.write('\n')
+    os.replace(tmpFile, manifest)
+
+
+def sha256(fileName, text=False, blockSize=1 << 20):
+    '''SHA-256 hash of a file, as hex string
+
+    With "text", CRLF line ends are hashed as LF, so that the hash does not
+    depend on how git has checked the file out (core.autocrlf on Windows).'''
+    h = hashlib.sha256()
+    with open(fileName, 'rb') as fh:
+        pending = b''
+        for block in iter(lambda: fh.read(blockSize), b''):
+            if text:
+                # a CR at the end of a block may be followed by a LF
+                block = (pending + block).replace(b'\r\n', b'\n')
+                pending = block[-1:] if block.endswith(b'\r') else b''
+                block = block[:len(block) - len(pending)]
+            h.update(block)
+        h.update(pending)
+    return h.hexdigest()
+
+
+def isText(entry):
+    '''True for the formats that git treats as text (see .gitattributes)'''
+    return entry.get('format') not in ('xls', 'zip')
+
+
+def find(inFile, subDir='', registry=None):
+    '''Entry for a file name as used by getData, e.g. ('altman_93.txt', r'..\\Data\\data_altman')
+
+    Windows and Unix separators are accepted. Returns None for files that are
+    not registered.'''
+    if registry is None:
+        registry = loadManifest()
+    inFile = inFile.replace('\\', '/')
+    if inFile in registry:
+        return registry[inFile]
+    candidates = [entry for entry in registry.values()
+                  if ('/' + entry['path']).endswith('/' + inFile)]
+    if len(candidates) > 1:
+        # use the directory to choose between files with the same name
+        subDir = subDir.replace('\\', '/').rstrip('/')
+        candidates = [entry for entry in candidates
+                      if os.path.dirname(entry['path'])
+                      and subDir.endswith(os.path.dirname(entry['path']))]
+    if len(candidates) == 1:
+        return candidates[0]
+    return None
+
+
+def findUrl(url, registry=None):
+    '''Entry for a URL, e.g. of an archive read by readZip
+
+    URLs that are not registered get a new entry, stored in "Data/downloads".'''
+    if registry is None:
+        registry = loadManifest()
+    for entry in registry.values():
+        if entry.get('url') == url:
+            return entry
+    name = url.rstrip('/').split('/')[-1]
+    return {'name': name, 'path': 'downloads/' + name, 'url': url,
+            'sha256': None, 'format': os.path.splitext(name)[1].lstrip('.'),
+            'parser': {}}
+
+
+def localPath(entry):
+    '''Where the file of an entry is stored'''
+    return os.path.join(DATA_DIR, *entry['path'].split('/'))
+
+
+def downloadPath(entry):
+    '''Where a downloaded file of an entry is stored
+
+    Downloads never replace the files under version control in "Data",
+    but are stored in "Data/downloads".'''
+    path = entry['path']
+    if not path.startswith('downloads/'):
+        path = 'downloads/' + path
+    return os.path.join(DATA_DIR, *path.split('/'))
+
+
+def samePath(path1, path2):
+    '''True if both paths are the same file'''
+    return os.path.normcase(os.path.abspath(path1)) == \
+        os.path.normcase(os.path.abspath(path2))
+
+
+def locate(inFile, subDir='', allowNetwork=None):
+    '''Local path of a file, named as for getData by "inFile" and "subDir"
+
+    Registered files are resolved (and checked) with "resolve". Other files,
+    and a local file of the user that just has the name of a registered
+    one, are taken from "subDir", relative to the directory of the programs.'''
+    fullInFile = os.path.join(os.path.dirname(__file__), subDir, inFile)
+    entry = find(inFile, subDir)
+    if entry is None or (os.path.isfile(fullInFile) and
+                         not samePath(fullInFile, localPath(entry))):
+        return fullInFile
+    return resolve(entry, allowNetwork)
+
+
+def fileHash(fileName, text=False):
+    '''SHA-256 of a file, computed only once for each (path, size, mtime)'''
+    st = os.stat(fileName)
+    key = (os.path.abspath(fileName), st.st_size, st.st_mtime_ns, text)
+    if key not in _verified:
+        _verified[key] = sha256(fileName, text)
+    return _verified[key]
+
+
+def learnedFile():
+    '''Hashes of downloads whose entries have no hash, keyed by URL'''
+    return os.path.join(DATA_DIR, 'downloads', 'hashes.json')
+
+
+def expectedHash(entry):
+    '''Registered hash of an entry, or the hash of its first download'''
+    if entry.get('sha256') is not None:
+        return entry['sha256']
+    try:
+        with open(learnedFile()) as fh:
+            return json.load(fh).get(entry['url'])
+    except (IOError, ValueError):
+        return None
+
+
+def validPath(entry):
+    '''The local file of an entry, or else its download, if it has the
+    expected hash; None otherwise
+
+    Files of entries without any known hash are not accepted, since their
+    origin cannot be checked.'''
+    expected = expectedHash(entry)
+    if expected is None:
+        return None
+    for fileName in (localPath(entry), downloadPath(entry)):
+        try:
+            if fileHash(fileName, isText(entry)) == expected:
+                return fileName
+        except OSError:
+            pass
+    return None
+
+
+def isValid(entry):
+    '''True if a local file of an entry has the expected hash'''
+    return validPath(entry) is not None
+
+
+def resolve(entry, allowNetwork=None, registry=None):
+    '''Local path of a registered file, fetched only if the network is allowed
+
+    Raises DataNotAvailable if the file is missing or corrupt, and cannot be
+    fetched.'''
+    if isinstance(entry, str):
+        name = entry
+        entry = find(name, registry=registry)
+        if entry is None:
+            raise DataNotAvailable(name + ' is not in the data registry')
+    fileName = validPath(entry)
+    if fileName is not None:
+        return fileName
+    if not networkAllowed(allowNetwork):
+        state = 'corrupt' if os.path.exists(localPath(entry)) else 'missing'
+        raise DataNotAvailable('{0} is {1}, and the network is disabled '
+                               '(set {2}=1 or run "python dataRegistry.py fetch")'
+                               .format(localPath(entry), state, NETWORK_VARIABLE))
+    return fetch(entry)
+
+
+def fetch(entry):
+    '''Download the file of an entry, and check its hash
+
+    The file is stored in "Data/downloads" (see downloadPath), so that files
+    under version control are never overwritten. For entries without a known
+    hash, the hash of the download is recorded in "Data/downloads/hashes.json",
+    and not in the (version controlled) manifest.'''
+    fileName = downloadPath(entry)
+    if not os.path.isdir(os.path.dirname(fileName)):
+        os.makedirs(os.path.dirname(fileName))
+    tmpFile = '{0}.{1}.part'.format(fileName, os.getpid())
+    try:
+        response = urlopen(entry['url'], timeout=TIMEOUT)
+        with open(tmpFile, 'wb') as fh:
+            for block in iter(lambda: response.read(1 << 20), b''):
+                fh.write(block)
+    except Exception as err:
+        if os.path.exists(tmpFile):
+            os.remove(tmpFile)
+        raise DataNotAvailable('{0} could not be fetched: {1}'.format(entry['url'], err))
+
+    digest = sha256(tmpFile, isText(entry))
+    expected = expectedHash(entry)
+    if expected is not None and digest != expected:
+        os.remove(tmpFile)
+        raise DataNotAvailable('{0} does not have the registered hash'.format(entry['url']))
+    os.replace(tmpFile, fileName)
+    if expected is None:
+        _learnHash(entry['url'], digest)
+    return fileName
+
+
+def _learnHash(url, digest):
+    '''Record the hash of the first download of an entry without hash'''
+    try:
+        with open(learnedFile()) as fh:
+            learned = json.load(fh)
+    except (IOError, ValueError):
+        learned = {}
+    learned[url] = digest
+    if not os.path.isdir(os.path.dirname(learnedFile())):
+        os.makedirs(os.path.dirname(learnedFile()))
+    tmpFile = '{0}.{1}.tmp'.format(learnedFile(), os.getpid())
+    with open(tmpFile, 'w') as fh:
+        json.dump(learned, fh, indent=1, sort_keys=True)
+    os.replace(tmpFile, learnedFile())
+
+
+def describe(relPath):
+    '''Format and parser options of a file in DATA_DIR, guessed from its content'''
+    ext = os.path.splitext(relPath)[1].lower()
+    if ext in ('.xls', '.xlsx'):
+        return 'xls', {'sheet_name': 0}
+    if ext == '.zip':
+        return 'zip', {}
+    with open(os.path.join(DATA_DIR, relPath), 'rb') as fh:
+        lines = fh.read(65536).splitlines()[:2]
+    if not lines or relPath.lower().endswith(('readme.txt', 'info.txt')) \
+            or lines[0].startswith(b'NAME:'):
+        # documentation, e.g. the descriptions of the amstat data sets
+        return 'text', {}
+    if b',' not in lines[0]:
+        # the *.dat.txt files from amstat have fixed-width columns
+        return 'fixed-width', {'delim_whitespace': True, 'header': None}
+    options = {'delimiter': ','}
+    try:
+        [float(field) for field in lines[0].split(b',')]
+    except ValueError:
+        options['skip_header'] = 1
+    return 'csv', options
+
+
+def build(registry=None):
+    '''Registry entries for all files in DATA_DIR, keeping the remote entries'''
+    if registry is None:
+        registry = loadManifest()
+    newRegistry = dict((name, entry) for name, entry in registry.items()
+                       if not entry['url'].startswith(URL_BASE))
+    for root, dirs, files in os.walk(DATA_DIR):
+        dirs[:] = sorted(d for d in dirs if d not in IGNORE)
+        for fileName in sorted(files):
+            if fileName in IGNORE:
+                continue
+            relPath = os.path.relpath(os.path.join(root, fileName), DATA_DIR)
+            relPath = relPath.replace(os.sep, '/')
+            fmt, options = describe(relPath)
+            newRegistry[relPath] = {
+                'name': relPath,
+                'path': relPath,
+                'url': URL_BASE + quote(relPath),
+                'sha256': sha256(os.path.join(root, fileName),
+                                 isText({'format': fmt})),
+                'size': os.path.getsize(os.path.join(root, fileName)),
+                'format': fmt,
+                'parser': options}
+    return newRegistry
+
+
+def main(args):
+    '''Command line interface, see the module docstring'''
+    command = args[0] if args else 'verify'
+    if command == 'build':
+        registry = build()
+        saveManifest(registry)
+        print('{0} entries written to {1}'.format(len(registry), MANIFEST))
+    elif command in ('fetch', 'verify'):
+        registry = loadManifest()
+        names = args[1:] or sorted(registry)
+        nBad = 0
+        for name in names:
+            entry = registry[name]
+            if isValid(entry):
+                continue
+            if command == 'fetch':
+                try:
+                    fetch(entry)
+                    print('fetched ' + name)
+                    continue
+                except DataNotAvailable as err:
+                    print(err)
+            else:
+                print('missing or corrupt: ' + name)
+            nBad += 1
+        print('{0} of {1} files available'.format(len(names) - nBad, len(names)))
+        return 1 if nBad else 0
+    else:
+        print(__doc__)
+        return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -4,6 +4,17 @@ I use these data quite often, so I have put those by default in a subdirectory
 "data_altman". This function reads them from there.
 
 If the data are not found locally, they are retrieved from the WWW.
+
+Local files are parsed only once: the parsed array is stored as a binary
+".npy" sidecar in a "__npycache__" directory next to the file, and later
+calls memory-map it (copy-on-write). The name of the sidecar contains a key
+of the path, size and modification time of the file, so that it is rebuilt
+when the file changes.
+
+Files are parsed with "parseText", which gives the same result as
+np.genfromtxt(..., delimiter=','), but uses the much faster np.loadtxt
+whenever the numeric columns of the file are clean (optionally below a
+header line).
 '''
 
 # Linked to text in: An Introduction to Statistics
@@ -13,36 +24,208 @@ If the data are not found locally, they are retrieved from the WWW.
 import numpy as np
 import os
 import sys
+import time
+import zlib
+from io import BytesIO
 
 # additional packages
 from os.path import join
 
+import dataRegistry
+
 if sys.version_info[0] == 3:
     from urllib.request import urlopen
-    from urllib.parse import urlparse
+    from urllib.parse import urlparse, quote
 else:
     from urlparse import urlparse
-    from urllib import urlopen
+    from urllib import urlopen, quote
+
+CACHE_DIR = '__npycache__'
+N_SAMPLE = 20    # lines that parseText inspects before choosing a parser
+
+def getData(inFile, subDir=r'..\Data', cache=True, allowNetwork=None):
+    '''Data are taken from examples in D. Altman, "Practical Statistics for Medical Research"
+
+    With "cache", local files are read from (and written to) the binary cache.
+    The data are mapped into memory copy-on-write, so they are loaded lazily,
+    but can be changed like any other array without touching the cache.
 
-def getData(inFile, subDir=r'..\Data'):
-    '''Data are taken from examples in D. Altman, "Practical Statistics for Medical Research" '''
-    dataDir = os.path.join(os.path.dirname(__file__), subDir)
-    fullInFile = join(dataDir, inFile)
+    Files of the data registry (see dataRegistry.py) are taken from "Data",
+    after checking their hash. They are downloaded only if "allowNetwork",
+    or the environment variable STATSINTRO_NETWORK, enables the network.'''
     try:
-        data = np.genfromtxt(fullInFile, delimiter=',')
+        fullInFile = dataRegistry.locate(inFile, subDir, allowNetwork)
+    except dataRegistry.DataNotAvailable as err:
+        print(err)
+        return ()
+    try:
+        if cache and os.path.isfile(fullInFile):
+            data = _cachedData(fullInFile)
+        else:
+            data = parseText(fullInFile)
     except IOError:
+        if not dataRegistry.networkAllowed(allowNetwork):
+            print((fullInFile + ' does not exist, and the network is disabled'))
+            return ()
         print((fullInFile + ' does not exist: Trying to read from WWW'))
         try:
-            url_base = 'https://raw.github.com/thomas-haslwanter/statsintro/master/Data/'
-            url = os.path.join(url_base, inFile)
+            url = dataRegistry.URL_BASE + quote(inFile.replace('\\', '/'))
             print(url)
-            fileHandle = urlopen(url)
-            data = np.genfromtxt(fileHandle, delimiter=',')
+            fileHandle = BytesIO(urlopen(url, timeout=dataRegistry.TIMEOUT).read())
+            data = parseText(fileHandle)
         except:
             print((url + ' also does not exist!'))
             data = ()
     return data
-    
+
+def parseText(source):
+    '''Parse comma-separated numbers, like np.genfromtxt(source, delimiter=',')
+
+    Files with the same numeric columns on every line are read with
+    np.loadtxt, which converts the values in C, into arrays that it
+    preallocates chunk by chunk. Text columns are skipped with "usecols",
+    and become columns of NaNs; a first line without any numbers (a header)
+    becomes a row of NaNs, as with genfromtxt. Everything else (missing
+    values, ragged rows, columns that mix numbers and text) is left to
+    genfromtxt. The decision is made on the first lines, so that most files
+    that do not fit do not pay for a failed np.loadtxt.
+
+    "source" is a file name, or a binary file object that can be rewound.'''
+    kinds = [_numericFields(line) for line in _firstLines(source, N_SAMPLE)]
+    skipHeader = 1 if len(kinds) > 1 and kinds[0][1] == () else 0
+    nFields, numeric = kinds[skipHeader] if kinds else (0, None)
+    if numeric and all(kind == (nFields, numeric) for kind in kinds[skipHeader:]) \
+            and kinds[0][0] == nFields:
+        _rewind(source)
+        try:
+            values = np.loadtxt(source, delimiter=',', dtype=float, ndmin=2,
+                                skiprows=skipHeader,
+                                usecols=numeric if len(numeric) < nFields else None)
+        except ValueError:
+            pass
+        else:
+            data = np.full((skipHeader + len(values), nFields), np.nan)
+            data[skipHeader:, list(numeric)] = values
+            return np.squeeze(data)
+
+    _rewind(source)
+    return np.genfromtxt(source, delimiter=',')
+
+def _rewind(source):
+    '''Go back to the start of a file object'''
+    if hasattr(source, 'seek'):
+        source.seek(0)
+
+def _firstLines(source, nLines, blockSize=65536):
+    '''The first nLines lines (at most) of a file name or binary file object'''
+    _rewind(source)
+    if hasattr(source, 'read'):
+        block = source.read(blockSize)
+    else:
+        with open(source, 'rb') as fh:
+            block = fh.read(blockSize)
+    # splitlines also splits at the "\r" line ends of old Mac files
+    return block.splitlines()[:nLines]
+
+def _numericFields(line):
+    '''Number of fields of a line, and the indices of the numeric fields'''
+    line = line.decode('latin-1')
+    if not line.strip() or line.lstrip().startswith('#'):
+        # blank lines and comments: leave those files to genfromtxt
+        return (0, None)
+    fields = line.split(',')
+    numeric = []
+    for ii, field in enumerate(fields):
+        try:
+            float(field)
+            numeric.append(ii)
+        except ValueError:
+            pass
+    return (len(fields), tuple(numeric))
+
+def benchmarkParsers(dataDir=None, repeat=3):
+    '''Time parseText against np.genfromtxt for every file in "dataDir"'''
+    import warnings
+    if dataDir is None:
+        dataDir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               '..', 'Data')
+    print('{0:45s} {1:>10s} {2:>10s} {3:>8s}'.format(
+        'file', 'genfromtxt', 'parseText', 'speedup'))
+    for root, dirs, files in os.walk(dataDir):
+        # skip the caches, downloads and the manifest (pruned during the walk)
+        dirs[:] = sorted(d for d in dirs if d not in dataRegistry.IGNORE)
+        for fileName in sorted(files):
+            if fileName in dataRegistry.IGNORE:
+                continue
+            fullInFile = join(root, fileName)
+            times = []
+            results = []
+            for parser in (lambda f: np.genfromtxt(f, delimiter=','), parseText):
+                best = np.inf
+                try:
+                    with warnings.catch_warnings():
+                        warnings.simplefilter('ignore')
+                        for ii in range(repeat):
+                            tStart = time.perf_counter()
+                            result = parser(fullInFile)
+                            best = min(best, time.perf_counter() - tStart)
+                except ValueError:
+                    result = None
+                times.append(best)
+                results.append(result)
+            name = os.path.relpath(fullInFile, dataDir)
+            if results[0] is None:
+                print('{0:45s} {1:>10s}'.format(name, 'fails'))
+                continue
+            assert np.array_equal(results[0], results[1], equal_nan=True)
+            print('{0:45s} {1:9.2f}ms {2:9.2f}ms {3:7.1f}x'.format(
+                name, 1e3*times[0], 1e3*times[1], times[0]/times[1]))
+
+def cachePath(fullInFile):
+    '''Sidecar file for the current version of "fullInFile"'''
+    fullInFile = os.path.abspath(fullInFile)
+    st = os.stat(fullInFile)
+    key = '{0}|{1}|{2}'.format(fullInFile, st.st_size, st.st_mtime_ns)
+    cacheDir = join(os.path.dirname(fullInFile), CACHE_DIR)
+    name = '{0}.{1:08x}.npy'.format(os.path.basename(fullInFile),
+                                    zlib.crc32(key.encode('utf-8')))
+    return cacheDir, name
+
+def _cachedData(fullInFile):
+    '''Parse "fullInFile" with parseText, or load it from the cache'''
+    cacheDir, name = cachePath(fullInFile)
+    cacheFile = join(cacheDir, name)
+    if not os.path.isfile(cacheFile):
+        data = parseText(fullInFile)
+        try:
+            if not os.path.isdir(cacheDir):
+                os.makedirs(cacheDir)
+            # remove the sidecars of previous versions of the file
+            prefix = os.path.basename(fullInFile) + '.'
+            for oldName in os.listdir(cacheDir):
+                if oldName.startswith(prefix) and oldName.endswith('.npy') \
+                        and oldName.count('.') == name.count('.'):
+                    os.remove(join(cacheDir, oldName))
+            # write to a temporary file first, so that other processes never
+            # see a partially written sidecar
+            tmpFile = '{0}.{1}.tmp'.format(cacheFile, os.getpid())
+            with open(tmpFile, 'wb') as fh:
+                np.save(fh, data)
+            os.replace(tmpFile, cacheFile)
+        except (IOError, OSError):
+            # e.g. a read-only data directory: just use the parsed data
+            return data
+    try:
+        # a plain (writable) ndarray, which does not pass np.memmap on to
+        # the arrays derived from it
+        return np.asarray(np.load(cacheFile, mmap_mode='c'))
+    except ValueError:
+        # arrays without elements cannot be memory-mapped
+        return np.load(cacheFile)
+
 if __name__ == '__main__':
-    data = getData(r'data_altman\altman_93.txt')
-    print(data)
+    if sys.argv[1:] == ['benchmark']:
+        benchmarkParsers()
+    else:
+        data = getData(r'data_altman\altman_93.txt')
+        print(data)
@@ -12,6 +12,7 @@ import numpy as np
 import pandas as pd
 
 # additional packages
+from binaryTable import loadTable
 from statsmodels.formula.api import ols
 import statsmodels.regression.linear_model as sm
 from statsmodels.stats.anova import anova_lm
@@ -19,7 +20,7 @@ from statsmodels.stats.anova import anova_lm
 def model_formulas():
     ''' Define models through formulas '''
     # Get the dta
-    data = pd.read_csv(r'..\Data\data_kaplan\swim100m.csv')
+    data = loadTable('swim100m.csv', subDir=r'..\Data\data_kaplan')
     
     # Different models
     model1 = ols("time ~ sex", data).fit()  # one factor
@@ -12,50 +12,133 @@ import numpy as np
 # additional packages
 from sklearn import metrics
 from scipy import linalg, optimize, sparse
+import concurrent.futures
+import mmap
+from multiprocessing import shared_memory
+import time
 import warnings
 
+import logistic_kernels
+
 BIG = 1e10
 SMALL = 1e-12
+# epochs without progress before the 'adam' solver halves its step size
+PATIENCE = 5
 
 
-def phi(t):
+def phi(t, out=None):
     """
     logistic function, returns 1 / (1 + exp(-t))
     """
-    idx = t > 0
-    out = np.empty(t.size, dtype=np.float)
-    out[idx] = 1. / (1 + np.exp(-t[idx]))
-    exp_t = np.exp(t[~idx])
-    out[~idx] = exp_t / (1. + exp_t)
-    return out
+    return logistic_kernels.logistic(t, out=out)
+
 
-def log_logistic(t):
+def log_logistic(t, out=None):
     """
     (minus) logistic loss function, returns log(1 / (1 + exp(-t)))
     """
-    idx = t > 0
-    out = np.zeros_like(t)
-    out[idx] = np.log(1 + np.exp(-t[idx]))
-    out[~idx] = (-t[~idx] + np.log(1 + np.exp(t[~idx])))
-    return out
+    out = logistic_kernels.log_logistic(t, out=out)
+    return np.negative(out, out=out)
+
+
+def _check_X(X):
+    """
+    Return X as CSR matrix or (possibly memory-mapped) array, without
+    densifying or copying it. Strings are paths of .npy files.
+    """
+    if isinstance(X, str):
+        return np.load(X, mmap_mode='r')
+    if sparse.issparse(X):
+        return X.tocsr()
+    if isinstance(X, np.memmap):
+        return X
+    return np.asarray(X)
+
+
+def _memmap_source(X):
+    """
+    (filename, offset, shape, dtype, order) of a contiguous np.memmap, from
+    which it can be mapped again in another process, or None.
+    """
+    if not isinstance(X, np.memmap) or X.filename is None or \
+            not (X.flags.c_contiguous or X.flags.f_contiguous):
+        return None
+    base = X
+    while isinstance(base, np.ndarray):
+        base = base.base
+    if not isinstance(base, mmap.mmap):
+        return None
+    # X.offset is that of the mapped file, also for views into it
+    start = np.frombuffer(base, dtype=np.uint8).ctypes.data
+    offset = X.offset - X.offset % mmap.ALLOCATIONGRANULARITY \
+        + X.ctypes.data - start
+    return (X.filename, offset, X.shape, X.dtype.str,
+            'C' if X.flags.c_contiguous else 'F')
 
 
 def ordinal_logistic_fit(X, y, alpha=0, l1_ratio=0, n_class=None, max_iter=10000,
-                         verbose=False, solver='TNC', w0=None):
+                         verbose=False, solver='TNC', w0=None,
+                         sample_weight=None, collapse=False, theta0=None,
+                         random_state=None, batch_size=1024,
+                         learning_rate=.1, tol=1e-4, return_cov=False):
     """
     Ordinal logistic regression or proportional odds model.
     Uses scipy's optimize.fmin_slsqp solver.
 
     Parameters
     ----------
-    X : {array, sparse matrix}, shape (n_samples, n_feaures)
-        Input data
+    X : {array, sparse matrix, str}, shape (n_samples, n_feaures)
+        Input data. Sparse matrices are used in CSR format and never
+        densified. Dense arrays (including np.memmap) are not copied, and a
+        string is taken as the path of a .npy file, which is memory-mapped,
+        so that X need not fit into memory.
     y : array-like
         Target values
+    alpha : float
+        Strength of the penalty
+        alpha * (l1_ratio * |w|_1 + .5 * (1 - l1_ratio) * w.w)
+    l1_ratio : float, 0 <= l1_ratio <= 1
+        Elastic-net mixing parameter. For l1_ratio > 0, w is split into its
+        positive and negative parts, which requires a solver that supports
+        bounds (TNC, L-BFGS-B, trust-constr).
     max_iter : int
         Maximum number of iterations
     verbose: bool
         Print convergence information
+    w0 : array, shape (n_features,), optional
+        Starting point for the coefficients (e.g. from a previous fit)
+    theta0 : array, shape (k,), optional
+        Starting point for the thresholds (e.g. from a previous fit)
+    sample_weight : array-like, shape (n_samples,), optional
+        Frequency weights of the samples
+    collapse : bool
+        Collapse identical (x, y) rows into a single row, weighted with their
+        frequency (times their sample_weight). This gives the same estimates,
+        at a fraction of the cost when X has only a few distinct rows.
+        Requires a dense X.
+    random_state : int or RandomState, optional
+        Seed of the random starting point (and of the rows of the
+        mini-batches). If None, the global numpy random state is used.
+    solver : str
+        A method of scipy.optimize.minimize, 'TRON' (requires pytron), or
+        'adam', a mini-batch solver for very large n_samples: each epoch
+        draws mini-batches of batch_size random rows (so the order of the
+        rows, e.g. sorted by y, does not matter), the thresholds are
+        projected back to increasing values after each step, and the result
+        is the best average of the iterates of an epoch. 'adam' supports
+        only l1_ratio = 0.
+    batch_size : int
+        Rows per mini-batch (solver='adam')
+    learning_rate : float
+        Initial step size, in units of standardized features, halved
+        whenever the objective stops decreasing (solver='adam')
+    tol : float
+        The 'adam' solver stops when the average iterate of an epoch changes
+        by less than tol (max-norm) from the previous best one, when the
+        step size falls below tol, or after max_iter epochs.
+    return_cov : bool
+        Also return the covariances of the estimates, see
+        ordinal_logistic_cov
 
     Returns
     -------
@@ -63,151 +146,214 @@ def ordinal_logistic_fit(X, y, alpha=0, l1_ratio=0, n_class=None, max_iter=10000
         coefficients of the linear model
     theta : array, shape (k,), where k is the different values of y
         vector of thresholds
+    cov : dict, only if return_cov
+        'observed' and 'sandwich' covariances of (w, theta)
     """
 
-    X = np.asarray(X)
+    X = _check_X(X)
     y = np.asarray(y)
-    w0 = None
 
     if not X.shape[0] == y.shape[0]:
         raise ValueError('Wrong shape for X and y')
+    if sample_weight is None:
+        sample_weight = np.ones(y.shape[0])
+    else:
+        sample_weight = np.asarray(sample_weight, dtype=float)
+        if not sample_weight.shape == y.shape:
+            raise ValueError('Wrong shape for sample_weight')
+
+    if collapse:
+        if sparse.issparse(X):
+            raise ValueError('collapse requires a dense X')
+        Xy, inverse = np.unique(np.column_stack((X, y)), axis=0,
+                                return_inverse=True)
+        sample_weight = np.bincount(inverse.ravel(), weights=sample_weight)
+        X, y = Xy[:, :-1], Xy[:, -1]
+
+    if random_state is None:
+        rng = np.random
+    elif isinstance(random_state, np.random.RandomState):
+        rng = random_state
+    else:
+        rng = np.random.RandomState(random_state)
+
+    if solver == 'adam':
+        if alpha * l1_ratio > 0:
+            raise ValueError('l1_ratio > 0 is not supported by adam')
+        w, theta = _fit_adam(X, y, sample_weight, alpha, w0, theta0, rng,
+                             max_iter, batch_size, learning_rate, tol, verbose)
+        if return_cov:
+            return w, theta, ordinal_logistic_cov(w, theta, X, y,
+                                                  sample_weight, alpha)
+        return w, theta
+
+    X_in, y_in, sw_in = X, y, sample_weight
 
     # .. order input ..
+    # Only y is sorted; instead of reordering (and copying) X, the vectors
+    # X.dot(w) and the arguments of X.T.dot are permuted.
     idx = np.argsort(y)
     idx_inv = np.zeros_like(idx)
     idx_inv[idx] = np.arange(idx.size)
-    X = X[idx]
-    y = y[idx].astype(np.int)
+    y = y[idx].astype(int)
+    sw = sample_weight[idx]
     # make them continuous and start at zero
     unique_y = np.unique(y)
     for i, u in enumerate(unique_y):
         y[y == u] = i
     unique_y = np.unique(y)
 
-    # .. utility arrays used in f_grad ..
-    alpha = 0.
+    # .. utility arrays used in f_eval ..
+    alpha_l1 = alpha * l1_ratio
+    alpha = alpha * (1. - l1_ratio)
     k1 = np.sum(y == unique_y[0])
-    E0 = (y[:, np.newaxis] == np.unique(y)).astype(np.int)
-    E1 = np.roll(E0, -1, axis=-1)
-    E1[:, -1] = 0.
-    E0, E1 = map(sparse.csr_matrix, (E0.T, E1.T))
-
-    def f_obj(x0, X, y):
+    # E0[k, i] = 1 if y[i] == k, E1[k, i] = 1 if y[i] == k + 1
+    rows = np.arange(y.size)
+    E0 = sparse.csr_matrix((np.ones(y.size), (y, rows)),
+                           shape=(unique_y.size, y.size))
+    E1 = sparse.csr_matrix((np.ones(y.size - k1), (y[k1:] - 1, rows[k1:])),
+                           shape=(unique_y.size, y.size))
+
+    Ex = (E1 - E0)[:, k1:]
+    cache = {}
+    # buffers reused by all evaluations of f_eval
+    ws = logistic_kernels.Workspace()
+    n, n_c = y.size, y.size - k1
+
+    def f_eval(x0, X, y):
         """
-        Objective function
+        Objective function and its gradient, computed in a single pass over
+        X. The result for the last x0 is cached, together with the
+        intermediate values needed by f_hess.
         """
+        x0 = np.asarray(x0)
+        if 'x0' in cache and np.array_equal(cache['x0'], x0):
+            return cache
         w, theta_0 = np.split(x0, [X.shape[1]])
         theta_1 = np.roll(theta_0, 1)
-        t0 = theta_0[y]
         z = np.diff(theta_0)
 
-        Xw = X.dot(w)
-        a = t0 - Xw
-        b = t0[k1:] - X[k1:].dot(w)
+        # b = t0[k1:] - X[k1:].dot(w) is just a[k1:]
+        a = np.take(X.dot(w), idx, out=ws.get('a', n))
+        np.subtract(np.take(theta_0, y, out=ws.get('t0', n)), a, out=a)
+        b = a[k1:]
         c = (theta_1 - theta_0)[y][k1:]
 
         if np.any(c > 0):
-            return BIG
+            loss = BIG
+        else:
+            #loss = -(c[idx] + np.log(np.exp(-c[idx]) - 1)).sum()
+            tmp = logistic_kernels.log1mexp(c, out=ws.get('tmp', n_c),
+                                            mask=ws.get('mask', n_c, bool))
+            loss = -sw[k1:].dot(tmp)
+
+            log_a = log_logistic(a, out=ws.get('log_a', n))
+            loss += sw[k1:].dot(np.add(b, log_a[k1:], out=tmp)) \
+                + sw.dot(log_a) \
+                + .5 * alpha * w.dot(w) - np.log(z).sum()  # penalty
+
+        # derivative of the loss w.r.t. a, including the b terms
+        phi_a = phi(a, out=ws.get('phi_a', n))
+        r = np.subtract(1, phi_a, out=ws.get('r', n))
+        r[k1:] -= phi_a[k1:]
+        r *= sw
 
-        #loss = -(c[idx] + np.log(np.exp(-c[idx]) - 1)).sum()
-        loss = -np.log(1 - np.exp(c)).sum()
+        # gradient for w
+        grad_w = X.T.dot(np.take(r, idx_inv, out=ws.get('r_x', n))) + alpha * w
 
-        loss += b.sum() + log_logistic(b).sum() \
-            + log_logistic(a).sum() \
-            + .5 * alpha * w.dot(w) - np.log(z).sum()  # penalty
-        if np.isnan(loss):
-            pass
-            #import ipdb; ipdb.set_trace()
-        return loss
+        # gradient for theta: 1 / (exp(-c) - 1)
+        tmp = np.negative(c, out=ws.get('tmp', n_c))
+        np.expm1(tmp, out=tmp)
+        np.reciprocal(tmp, out=tmp)
+        tmp *= sw[k1:]
+        grad_theta = Ex.dot(tmp) - E0.dot(r)
+
+        grad_theta[:-1] += 1. / z
+        grad_theta[1:] -= 1. / z
+
+        cache.update(x0=x0.copy(), loss=loss, c=c, z=z, phi_a=phi_a,
+                     grad=np.concatenate((grad_w, grad_theta)))
+        return cache
+
+    def f_obj(x0, X, y):
+        """
+        Objective function
+        """
+        return f_eval(x0, X, y)['loss']
 
     def f_grad(x0, X, y):
         """
         Gradient of the objective function
         """
-        w, theta_0 = np.split(x0, [X.shape[1]])
-        theta_1 = np.roll(theta_0, 1)
-        t0 = theta_0[y]
-        t1 = theta_1[y]
-        z = np.diff(theta_0)
-
-        Xw = X.dot(w)
-        a = t0 - Xw
-        b = t0[k1:] - X[k1:].dot(w)
-        c = (theta_1 - theta_0)[y][k1:]
-
-        # gradient for w
-        phi_a = phi(a)
-        phi_b = phi(b)
-        grad_w = -X[k1:].T.dot(phi_b) + X.T.dot(1 - phi_a) + alpha * w
-
-        # gradient for theta
-        idx = c > 0
-        tmp = np.empty_like(c)
-        tmp[idx] = 1. / (np.exp(-c[idx]) - 1)
-        tmp[~idx] = np.exp(c[~idx]) / (1 - np.exp(c[~idx])) # should not need
-        grad_theta = (E1 - E0)[:, k1:].dot(tmp) \
-            + E0[:, k1:].dot(phi_b) - E0.dot(1 - phi_a)
-
-        grad_theta[:-1] += 1. / np.diff(theta_0)
-        grad_theta[1:] -= 1. / np.diff(theta_0)
-        out = np.concatenate((grad_w, grad_theta))
-        return out
+        return f_eval(x0, X, y)['grad']
 
     def f_hess(x0, s, X, y):
-        x0 = np.asarray(x0)
-        w, theta_0 = np.split(x0, [X.shape[1]])
-        theta_1 = np.roll(theta_0, 1)
-        t0 = theta_0[y]
-        t1 = theta_1[y]
-        z = np.diff(theta_0)
+        """
+        Hessian-vector product, computed without forming the Hessian:
+        H.s = J^T (d * (J.s)), where J are the Jacobians of a, b and c
+        """
+        ev = f_eval(x0, X, y)
+        c, z, phi_a = ev['c'], ev['z'], ev['phi_a']
+        s_w, s_theta = np.split(np.asarray(s), [X.shape[1]])
 
-        Xw = X.dot(w)
-        a = t0 - Xw
-        b = t0[k1:] - X[k1:].dot(w)
-        c = (theta_1 - theta_0)[y][k1:]
+        # second derivatives of the loss w.r.t. a, b and c (b = a[k1:])
+        d_a = sw * phi_a * (1 - phi_a)
+        d_c = sw[k1:] * np.exp(-c) / (np.exp(-c) - 1) ** 2
 
-        D = np.diag(phi(a) * (1 - phi(a)))
-        D_= np.diag(phi(b) * (1 - phi(b)))
-        D1 = np.diag(np.exp(-c) / (np.exp(-c) - 1) ** 2)
-        Ex = (E1 - E0)[:, k1:].toarray()
-        Ex0 = E0.toarray()
-        H_A = X[k1:].T.dot(D_).dot(X[k1:]) + X.T.dot(D).dot(X)
-        H_C = - X[k1:].T.dot(D_).dot(E0[:, k1:].T.toarray()) \
-            - X.T.dot(D).dot(E0.T.toarray())
-        H_B = Ex.dot(D1).dot(Ex.T) + Ex0[:, k1:].dot(D_).dot(Ex0[:, k1:].T) \
-            - Ex0.dot(D).dot(Ex0.T)
-
-        p_w = H_A.shape[0]
-        tmp0 = H_A.dot(s[:p_w]) + H_C.dot(s[p_w:])
-        tmp1 = H_C.T.dot(s[:p_w]) + H_B.dot(s[p_w:])
-        return np.concatenate((tmp0, tmp1))
-
-        import ipdb; ipdb.set_trace()
-        import pylab as pl
-        pl.matshow(H_B)
-        pl.colorbar()
-        pl.title('True')
-        import numdifftools as nd
-        Hess = nd.Hessian(lambda x: f_obj(x, X, y))
-        H = Hess(x0)
-        pl.matshow(H[H_A.shape[0]:, H_A.shape[0]:])
-        #pl.matshow()
-        pl.title('estimated')
-        pl.colorbar()
-        pl.show()
+        # directional derivatives of a, b and c along s
+        u_a = E0.T.dot(s_theta) - X.dot(s_w)[idx]
+        u_c = Ex.T.dot(s_theta)
 
+        v = d_a * u_a
+        v[k1:] *= 2
+        hess_w = -X.T.dot(v[idx_inv]) + alpha * s_w
+        hess_theta = E0.dot(v) + Ex.dot(d_c * u_c)
+
+        # log-barrier on the differences of the thresholds
+        v_z = np.diff(s_theta) / z ** 2
+        hess_theta[:-1] -= v_z
+        hess_theta[1:] += v_z
+        return np.concatenate((hess_w, hess_theta))
 
     def grad_hess(x0, X, y):
         grad = f_grad(x0, X, y)
         hess = lambda x: f_hess(x0, x, X, y)
         return grad, hess
 
-    x0 = np.random.randn(X.shape[1] + unique_y.size) / X.shape[1]
+    x0 = rng.randn(X.shape[1] + unique_y.size) / X.shape[1]
     if w0 is not None:
         x0[:X.shape[1]] = w0
     else:
         x0[:X.shape[1]] = 0.
-    x0[X.shape[1]:] = np.sort(unique_y.size * np.random.rand(unique_y.size))
+    x0[X.shape[1]:] = np.sort(unique_y.size * rng.rand(unique_y.size))
+    if theta0 is not None:
+        x0[X.shape[1]:] = theta0
+
+    p = X.shape[1]
+    bounds = None
+    if alpha_l1 > 0:
+        # .. elastic net: w = w_pos - w_neg, with w_pos, w_neg >= 0 ..
+        if solver == 'TRON':
+            raise ValueError('l1_ratio > 0 is not supported by TRON')
+        f_smooth_obj, f_smooth_grad, f_smooth_hess = f_obj, f_grad, f_hess
+
+        def to_full(x):
+            return np.concatenate((x[:p] - x[p:2 * p], x[2 * p:]))
+
+        def f_obj(x0, X, y):
+            return f_smooth_obj(to_full(x0), X, y) + alpha_l1 * x0[:2 * p].sum()
+
+        def f_grad(x0, X, y):
+            g = f_smooth_grad(to_full(x0), X, y)
+            return np.concatenate((g[:p] + alpha_l1, -g[:p] + alpha_l1, g[p:]))
+
+        def f_hess(x0, s, X, y):
+            h = f_smooth_hess(to_full(x0), to_full(s), X, y)
+            return np.concatenate((h[:p], -h[:p], h[p:]))
+
+        x0 = np.concatenate((np.maximum(x0[:p], 0), np.maximum(-x0[:p], 0),
+                             x0[p:]))
+        bounds = [(0, None)] * (2 * p) + [(None, None)] * unique_y.size
 
     #print('Check grad: %s' % optimize.check_grad(f_obj, f_grad, x0, X, y))
     #print(optimize.approx_fprime(x0, f_obj, 1e-6, X, y))
@@ -228,26 +374,584 @@ def ordinal_logistic_fit(X, y, alpha=0, l1_ratio=0, n_class=None, max_iter=10000
     else:
         options = {'maxiter' : max_iter, 'disp': 0, 'maxfun':10000}
         out = optimize.minimize(f_obj, x0, args=(X, y), method=solver,
-            jac=f_grad, hessp=f_hess, options=options, callback=callback)
+            jac=f_grad, hessp=f_hess, bounds=bounds, options=options,
+            callback=callback)
 
     if not out.success:
         warnings.warn(out.message)
-    w, theta = np.split(out.x, [X.shape[1]])
+    x = out.x if bounds is None else to_full(out.x)
+    w, theta = np.split(x, [X.shape[1]])
+    if return_cov:
+        return w, theta, ordinal_logistic_cov(w, theta, X_in, y_in, sw_in,
+                                              alpha)
     return w, theta
 
 
+def _chunk_loss_grad(w, theta, X, y, sw, return_grad=True):
+    """
+    Data terms of the objective of ordinal_logistic_fit, and their gradient,
+    for a chunk of rows in any order (y: levels 0..k-1).
+    """
+    n_class = theta.size
+    a = theta[y] - X.dot(w)
+    upper = y > 0
+    c = theta[y[upper] - 1] - theta[y[upper]]
+    sw_c = sw[upper]
+
+    log_a = log_logistic(a)
+    loss = sw.dot(log_a) + sw_c.dot(a[upper] + log_a[upper]) \
+        - sw_c.dot(logistic_kernels.log1mexp(c))
+    if not return_grad:
+        return loss
+
+    phi_a = phi(a)
+    r = 1 - phi_a
+    r[upper] -= phi_a[upper]
+    r *= sw
+    tmp = sw_c / np.expm1(-c)
+
+    grad_w = X.T.dot(r)
+    grad_theta = np.bincount(y[upper] - 1, tmp, n_class) \
+        - np.bincount(y[upper], tmp, n_class) - np.bincount(y, r, n_class)
+    return loss, grad_w, grad_theta
+
+
+def _fit_adam(X, y, sample_weight, alpha, w0, theta0, rng, max_iter,
+              batch_size, learning_rate, tol, verbose):
+    """
+    Mini-batch Adam for the objective of ordinal_logistic_fit, see there.
+
+    The iterates are the coefficients of the standardized features,
+    w_s = w * sd, and the thresholds of the centered features,
+    theta_c = theta - mu.w, so that the step size is in comparable units
+    for all parameters. X itself is never centered or copied.
+
+    After each epoch the objective is evaluated at the average of its
+    iterates, in one more pass over the chunks. If it did not decrease for
+    PATIENCE epochs, the iterates oscillate around the optimum with an
+    amplitude ~ step size: the step size is halved and the next epoch
+    restarts from the best average so far. The result is the best average.
+    """
+    unique_y, y = np.unique(y, return_inverse=True)
+    y = y.ravel()
+    n_samples, n_features = X.shape
+    n_class = unique_y.size
+    starts = np.arange(0, n_samples, batch_size)
+
+    def chunks():
+        for start in starts:
+            stop = min(start + batch_size, n_samples)
+            yield X[start:stop], y[start:stop], sample_weight[start:stop]
+
+    def batches():
+        # random rows, not random blocks: sorted data (e.g. by y) would
+        # give mini-batches of one level, and a biased gradient
+        perm = rng.permutation(n_samples)
+        for start in starts:
+            idx = np.sort(perm[start:start + batch_size])
+            yield X[idx], y[idx], sample_weight[idx]
+
+    # .. weighted mean and standard deviation of the features ..
+    s1, s2 = np.zeros(n_features), np.zeros(n_features)
+    for X_c, _, sw_c in chunks():
+        s1 += X_c.T.dot(sw_c)
+        s2 += (X_c.multiply(X_c) if sparse.issparse(X_c) else X_c ** 2).T.dot(sw_c)
+    mu = s1 / sample_weight.sum()
+    sd = np.sqrt(np.maximum(s2 / sample_weight.sum() - mu ** 2, 0))
+    sd[sd == 0] = 1.
+
+    def to_model(x):
+        w = x[:n_features] / sd
+        return w, x[n_features:] + mu.dot(w)
+
+    x = np.zeros(n_features + n_class)
+    x[n_features:] = np.sort(n_class * rng.rand(n_class))
+    if w0 is not None:
+        x[:n_features] = w0 * sd
+    if theta0 is not None:
+        x[n_features:] = theta0 - mu.dot(to_model(x)[0])
+    gaps = SMALL * np.arange(n_class)
+
+    def f_obj(x):
+        w, theta = to_model(x)
+        loss = sum(_chunk_loss_grad(w, theta, *chunk, return_grad=False)
+                   for chunk in chunks())
+        return loss + .5 * alpha * w.dot(w) - np.log(np.diff(theta)).sum()
+
+    m, v = np.zeros_like(x), np.zeros_like(x)
+    beta1, beta2, eps = .9, .999, 1e-8
+    lr, step, n_bad = learning_rate, 0, 0
+    x_best, f_best = x.copy(), f_obj(x)
+    for epoch in range(max_iter):
+        x_sum = np.zeros_like(x)
+        for chunk in batches():
+            w, theta = to_model(x)
+            grad_w, grad_theta = _chunk_loss_grad(w, theta, *chunk)[1:]
+            # unbiased estimate of the gradient of the full objective (the
+            # last batch may be shorter, so it is scaled like the others)
+            grad_w *= starts.size
+            grad_theta *= starts.size
+            grad_w += alpha * w
+            z = np.diff(theta)
+            grad_theta[:-1] += 1. / z
+            grad_theta[1:] -= 1. / z
+            # chain rule for w_s and theta_c
+            grad = np.concatenate(((grad_w + grad_theta.sum() * mu) / sd,
+                                   grad_theta))
+
+            step += 1
+            m = beta1 * m + (1 - beta1) * grad
+            v = beta2 * v + (1 - beta2) * grad ** 2
+            x -= lr * (m / (1 - beta1 ** step)) \
+                / (np.sqrt(v / (1 - beta2 ** step)) + eps)
+            # keep the thresholds increasing
+            x[n_features:] = np.maximum.accumulate(x[n_features:] - gaps) + gaps
+            x_sum += x
+
+        x_mean = x_sum / starts.size
+        f_mean = f_obj(x_mean)
+        if verbose:
+            print('EPOCH %s: OBJ %s, step size %s' % (epoch + 1, f_mean, lr))
+        if f_mean < f_best:
+            change = np.abs(x_mean - x_best).max()
+            x_best, f_best, n_bad = x_mean, f_mean, 0
+            if change < tol:
+                break
+        else:
+            n_bad += 1
+        if n_bad == PATIENCE:
+            lr *= .5
+            if lr < tol:
+                break
+            x, n_bad = x_best.copy(), 0
+    else:
+        warnings.warn('adam did not converge in %s epochs' % max_iter)
+
+    return to_model(x_best)
+
+def ordinal_logistic_cov(w, theta, X, y, sample_weight=None, alpha=0):
+    """
+    Covariances of the estimates of ordinal_logistic_fit.
+
+    The Hessian H of the objective (the observed information) and the
+    per-row scores s_i are computed in a single vectorized pass over X,
+    from the Jacobians of a = theta[y] - X.w and c = theta[y-1] - theta[y].
+
+    Parameters
+    ----------
+    w, theta : arrays
+        Estimates returned by ordinal_logistic_fit
+    X : {array, sparse matrix, str}, shape (n_samples, n_feaures)
+        Input data, as for ordinal_logistic_fit
+    y : array-like
+        Target values
+    sample_weight : array-like, shape (n_samples,), optional
+        Frequency weights of the samples
+    alpha : float
+        Strength of the L2 penalty of the fit
+
+    Returns
+    -------
+    cov : dict
+        'observed': inv(H), and 'sandwich': the robust (Huber-White)
+        covariance inv(H) B inv(H), with B = sum_i sample_weight_i s_i s_i',
+        of the parameters (w, theta), shape (n_features + k, n_features + k)
+    """
+    X = _check_X(X)
+    _, y = np.unique(y, return_inverse=True)
+    y = y.ravel()
+    n_samples, n_features = X.shape
+    n_class = theta.size
+    sw = np.ones(n_samples) if sample_weight is None else \
+        np.asarray(sample_weight, dtype=float)
+
+    # .. first and second derivatives of the loss of each row w.r.t. a, c ..
+    a = theta[y] - X.dot(w)
+    upper = y > 0
+    c = np.zeros(n_samples)
+    c[upper] = theta[y[upper] - 1] - theta[y[upper]]
+    phi_a = phi(a)
+    g_a = phi_a * (1 + upper) - 1
+    g_c = np.zeros(n_samples)
+    g_c[upper] = 1. / np.expm1(-c[upper])
+    d_a = phi_a * (1 - phi_a) * (1 + upper)
+    d_c = np.zeros(n_samples)
+    d_c[upper] = np.exp(-c[upper]) / np.expm1(-c[upper]) ** 2
+
+    # .. Jacobians of a and c w.r.t. (w, theta) ..
+    rows = np.arange(n_samples)
+    E_a = sparse.csr_matrix((np.ones(n_samples), (rows, y)),
+                            shape=(n_samples, n_class))
+    rows_c = np.nonzero(upper)[0]
+    J_c = sparse.csr_matrix(
+        (np.r_[np.ones(rows_c.size), -np.ones(rows_c.size)],
+         (np.r_[rows_c, rows_c], n_features + np.r_[y[rows_c] - 1, y[rows_c]])),
+        shape=(n_samples, n_features + n_class))
+    if sparse.issparse(X):
+        J_a = sparse.hstack((-X, E_a)).tocsr()
+    else:
+        J_a = np.hstack((-X, E_a.toarray()))
+        J_c = J_c.toarray()
+
+    H = _gram(J_a, sw * d_a) + _gram(J_c, sw * d_c)
+    H[:n_features, :n_features] += alpha * np.eye(n_features)
+    # log-barrier on the differences of the thresholds
+    D = np.diff(np.eye(n_class), axis=0)
+    H[n_features:, n_features:] += D.T.dot(D / np.diff(theta)[:, None] ** 2)
+
+    scores = _scale_rows(J_a, g_a) + _scale_rows(J_c, g_c)
+    B = _gram(scores, sw)
+    H_inv = linalg.inv(H)
+    return {'observed': H_inv, 'sandwich': H_inv.dot(B).dot(H_inv)}
+
+
+def _scale_rows(J, d):
+    """Multiply the rows of the (sparse) matrix J by d."""
+    if sparse.issparse(J):
+        return sparse.diags(d).dot(J)
+    return J * d[:, None]
+
+
+def _gram(J, d):
+    """Dense J' diag(d) J."""
+    G = J.T.dot(_scale_rows(J, d))
+    return G.toarray() if sparse.issparse(G) else G
+
+
+def ordinal_logistic_bootstrap(X, y, n_boot=200, sample_weight=None,
+                               random_state=None, **kwargs):
+    """
+    Bootstrap replicates of the estimates of ordinal_logistic_fit.
+
+    Each replicate is a fit with multinomial resampling counts as sample
+    weights (times sample_weight), warm-started from the solution on the
+    full data, which is close to the solution of every replicate. Draws in
+    which a level of y gets no weight are redrawn.
+
+    Parameters
+    ----------
+    X : {array, sparse matrix, str}, shape (n_samples, n_feaures)
+        Input data, as for ordinal_logistic_fit
+    y : array-like
+        Target values
+    n_boot : int
+        Number of bootstrap replicates
+    sample_weight : array-like, shape (n_samples,), optional
+        Frequency weights of the samples
+    random_state : int or RandomState, optional
+        Seed of the resampling
+    kwargs :
+        Further arguments of ordinal_logistic_fit
+
+    Returns
+    -------
+    w, theta : arrays
+        Estimates on the full data
+    boot_w : array, shape (n_boot, n_features)
+        Bootstrap replicates of w
+    boot_theta : array, shape (n_boot, k)
+        Bootstrap replicates of theta
+    """
+    X = _check_X(X)
+    y = np.asarray(y)
+    _, codes = np.unique(y, return_inverse=True)
+    codes = codes.ravel()
+    n_class = codes.max() + 1
+    if sample_weight is None:
+        sample_weight = np.ones(y.size)
+    rng = random_state if isinstance(random_state, np.random.RandomState) \
+        else np.random.RandomState(random_state)
+
+    w, theta = ordinal_logistic_fit(X, y, sample_weight=sample_weight,
+                                    random_state=rng, **kwargs)
+    boot_w, boot_theta = [], []
+    while len(boot_w) < n_boot:
+        counts = rng.multinomial(y.size, np.ones(y.size) / y.size)
+        sw = counts * sample_weight
+        if np.count_nonzero(np.bincount(codes, sw, n_class)) < n_class:
+            continue
+        w_b, theta_b = ordinal_logistic_fit(X, y, sample_weight=sw, w0=w,
+                                            theta0=theta, random_state=rng,
+                                            **kwargs)
+        boot_w.append(w_b)
+        boot_theta.append(theta_b)
+    return w, theta, np.array(boot_w), np.array(boot_theta)
+
+def ordinal_logistic_path(X, y, alphas=None, l1_ratio=0, n_alphas=50,
+                          eps=None, **kwargs):
+    """
+    Fit ordinal logistic regression models along a path of penalties.
+
+    The penalties are fitted in descending order, and each fit is
+    warm-started from the coefficients and thresholds of the previous one,
+    so that the whole path costs little more than a few independent fits.
+
+    Parameters
+    ----------
+    X : {array, sparse matrix, str}, shape (n_samples, n_feaures)
+        Input data, as for ordinal_logistic_fit
+    y : array-like
+        Target values
+    alphas : array-like, optional
+        Penalties. If None, n_alphas values are spaced logarithmically from
+        alpha_max (where all coefficients vanish for the lasso) down to
+        eps * alpha_max.
+    l1_ratio : float
+        Elastic-net mixing parameter, see ordinal_logistic_fit
+    n_alphas : int
+        Number of penalties, if alphas is None
+    eps : float, optional
+        Length of the path, alpha_min / alpha_max. If None, 1e-3 for
+        l1_ratio > 0, and 1e-6 for the ridge penalty (l1_ratio = 0), whose
+        coefficients shrink only gradually, so that the last fits are close
+        to the unpenalized one.
+    kwargs :
+        Further arguments of ordinal_logistic_fit
+
+    Returns
+    -------
+    alphas : array, shape (n_alphas,)
+        The penalties, in descending order
+    coefs : array, shape (n_alphas, n_features)
+        Coefficients along the path
+    thetas : array, shape (n_alphas, k)
+        Thresholds along the path
+    """
+    X = _check_X(X)
+    if alphas is None:
+        if eps is None:
+            eps = 1e-3 if l1_ratio > 0 else 1e-6
+        alpha_max = _alpha_max(X, y, l1_ratio, kwargs.get('sample_weight'))
+        alphas = np.logspace(np.log10(alpha_max), np.log10(alpha_max * eps),
+                             n_alphas)
+    else:
+        alphas = np.sort(alphas)[::-1]
+
+    w, theta = None, None
+    coefs, thetas = [], []
+    for alpha in alphas:
+        w, theta = ordinal_logistic_fit(X, y, alpha=alpha, l1_ratio=l1_ratio,
+                                        w0=w, theta0=theta, **kwargs)
+        coefs.append(w)
+        thetas.append(theta)
+    return alphas, np.array(coefs), np.array(thetas)
+
+
+def _alpha_max(X, y, l1_ratio, sample_weight=None):
+    """
+    Smallest penalty for which the lasso solution is w = 0: the largest
+    gradient of the loss w.r.t. w at w = 0, with the thresholds of the null
+    model, P(y <= k) = phi(theta_k). For 0 < l1_ratio < 1e-3 it is scaled
+    as for l1_ratio = 1e-3. The ridge penalty (l1_ratio = 0) never makes the
+    coefficients vanish; the lasso value is used as its starting point.
+    """
+    _, y = np.unique(y, return_inverse=True)
+    y = y.ravel()
+    if sample_weight is None:
+        sample_weight = np.ones(y.size)
+    counts = np.bincount(y, weights=sample_weight)
+    # smoothed cumulative proportions, which keep the thresholds finite
+    cum = (np.cumsum(counts) + .5) / (counts.sum() + 1.)
+    phi_a = phi(np.log(cum / (1 - cum))[y])
+    r = 1 - phi_a
+    r[y > 0] -= phi_a[y > 0]
+    grad_w = X.T.dot(r * sample_weight)
+    if l1_ratio == 0:
+        return np.abs(grad_w).max()
+    return np.abs(grad_w).max() / max(l1_ratio, 1e-3)
+
+
+def ordinal_logistic_cv(X, y, n_splits=50, test_size=.1, random_state=0,
+                        n_jobs=None, verbose=False, **kwargs):
+    """
+    Cross-validate ordinal logistic regression on random train/test splits.
+
+    The splits are drawn like sklearn's ShuffleSplit, and each fold gets its
+    own seed for the starting point of the fit, so the results depend only on
+    random_state and not on n_jobs. With n_jobs > 1 the folds are run by a
+    process pool; a dense X is then placed in shared memory once, instead of
+    being pickled for every fold, and a memory-mapped X is re-opened by each
+    worker from its file. Folds whose train set misses a class are
+    skipped, as in main().
+
+    Parameters
+    ----------
+    X : {array, sparse matrix, str}, shape (n_samples, n_feaures)
+        Input data, as for ordinal_logistic_fit
+    y : array-like
+        Target values
+    n_splits : int
+        Number of random splits
+    test_size : float
+        Fraction of the samples in each test set
+    random_state : int
+        Seed of the splits and of the fits
+    n_jobs : int, optional
+        Number of worker processes. If None or 1, the folds are run in this
+        process.
+    verbose : bool
+        Print the result of each fold
+    kwargs :
+        Further arguments of ordinal_logistic_fit
+
+    Returns
+    -------
+    results : dict of arrays
+        'fold' (index of the split), 'mae' (mean absolute error on the test
+        set), and 'fit_time' and 'predict_time' (wall time, in seconds).
+    """
+    X = _check_X(X)
+    y = np.asarray(y)
+    n_samples = y.size
+    n_test = int(np.ceil(test_size * n_samples))
+    rng = np.random.RandomState(random_state)
+    _, codes = np.unique(y, return_inverse=True)
+    n_class = codes.max() + 1
+
+    folds = []
+    for i, seed in enumerate(rng.randint(2 ** 31 - 1, size=n_splits)):
+        perm = rng.permutation(n_samples)
+        train, test = np.sort(perm[n_test:]), np.sort(perm[:n_test])
+        # we need the train set to have all different classes
+        if np.count_nonzero(np.bincount(codes[train], minlength=n_class)) < n_class:
+            continue
+        folds.append((i, train, test, seed))
+
+    if n_jobs in (None, 1):
+        _cv_init(X, None, y, kwargs)
+        try:
+            results = [_cv_fold(fold) for fold in folds]
+        finally:
+            _CV_DATA.clear()
+    else:
+        shm = None
+        if _memmap_source(X) is not None:
+            # the workers map the file again, rather than unpickling a copy
+            X_arg, shared = None, ('memmap',) + _memmap_source(X)
+        elif isinstance(X, np.ndarray) and not isinstance(X, np.memmap):
+            # read-only data shared by all workers, rather than pickled
+            shm = shared_memory.SharedMemory(create=True, size=max(X.nbytes, 1))
+            np.ndarray(X.shape, X.dtype, buffer=shm.buf)[...] = X
+            X_arg, shared = None, ('shm', shm.name, X.shape, X.dtype.str)
+        else:
+            X_arg, shared = X, None
+        try:
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=n_jobs, initializer=_cv_init,
+                    initargs=(X_arg, shared, y, kwargs)) as pool:
+                results = list(pool.map(_cv_fold, folds))
+        finally:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+
+    if verbose:
+        for i, mae, fit_time, _ in results:
+            print('ERROR (ORDINAL)  fold %s: %s (%.3fs)' % (i + 1, mae, fit_time))
+    results = np.array(results).reshape(-1, 4)
+    return {'fold': results[:, 0].astype(int), 'mae': results[:, 1],
+            'fit_time': results[:, 2], 'predict_time': results[:, 3]}
+
+
+# data of the cross-validation, set in each worker by _cv_init
+_CV_DATA = {}
+
+
+def _cv_init(X, shared, y, kwargs):
+    """Set the data of ordinal_logistic_cv, attaching X from shared memory
+    or from its memory-mapped file."""
+    if shared is not None and shared[0] == 'memmap':
+        filename, offset, shape, dtype, order = shared[1:]
+        X = np.memmap(filename, dtype, mode='r', offset=offset, shape=shape,
+                      order=order)
+    elif shared is not None:
+        name, shape, dtype = shared[1:]
+        shm = shared_memory.SharedMemory(name=name)
+        X = np.ndarray(shape, dtype, buffer=shm.buf)
+        X.flags.writeable = False
+        _CV_DATA['shm'] = shm
+    _CV_DATA.update(X=X, y=y, kwargs=kwargs)
+
+
+def _cv_fold(fold):
+    """Fit and score one fold of ordinal_logistic_cv."""
+    i, train, test, seed = fold
+    X, y = _CV_DATA['X'], _CV_DATA['y']
+    t0 = time.perf_counter()
+    w, theta = ordinal_logistic_fit(X[train], y[train], random_state=seed,
+                                    **_CV_DATA['kwargs'])
+    t1 = time.perf_counter()
+    pred = ordinal_logistic_predict(w, theta, X[test])
+    t2 = time.perf_counter()
+    return i, metrics.mean_absolute_error(y[test], pred), t1 - t0, t2 - t1
+
+
 def ordinal_logistic_predict(w, theta, X):
     """
     Parameters
     ----------
     w : coefficients obtained by ordinal_logistic
     theta : thresholds
+    X : {array, sparse matrix, str}, shape (n_samples, n_feaures)
+        Input data, as for ordinal_logistic_fit
     """
     unique_theta = np.sort(np.unique(theta))
-    out = X.dot(w)
+    out = _check_X(X).dot(w)
     unique_theta[-1] = np.inf # p(y <= max_level) = 1
-    tmp = out[:, None].repeat(unique_theta.size, axis=1)
-    return np.argmax(tmp < unique_theta, axis=1)
+    # first level whose threshold lies above the score
+    return np.searchsorted(unique_theta, out, side='right')
+
+
+def ordinal_logistic_predict_proba(w, theta, X, cumulative=False,
+                                   chunk_size=65536, out=None):
+    """
+    Probabilities of the levels, P(y = k) or P(y <= k).
+
+    The rows of X are processed in chunks of chunk_size, so that the
+    temporaries do not grow with the number of samples; with out a
+    memory-mapped array, the memory use is constant. The differences
+    P(y <= k) - P(y <= k-1) are computed as
+    phi(a) phi(-b) (1 - exp(b - a)), which does not cancel when both
+    probabilities are close to 1.
+
+    Parameters
+    ----------
+    w : coefficients obtained by ordinal_logistic
+    theta : thresholds
+    X : {array, sparse matrix, str}, shape (n_samples, n_feaures)
+        Input data, as for ordinal_logistic_fit
+    cumulative : bool
+        Return P(y <= k) instead of P(y = k)
+    chunk_size : int
+        Number of rows per chunk
+    out : array, shape (n_samples, k), optional
+        Array for the result
+
+    Returns
+    -------
+    out : array, shape (n_samples, k)
+    """
+    X = _check_X(X)
+    theta = np.sort(theta)
+    n_samples, n_class = X.shape[0], theta.size
+    if out is None:
+        out = np.empty((n_samples, n_class))
+    # log(1 - exp(theta_{k-1} - theta_k)), the same for all rows
+    log_gap = np.log(-np.expm1(theta[:-2] - theta[1:-1]))
+    for start in range(0, n_samples, chunk_size):
+        stop = min(start + chunk_size, n_samples)
+        a = theta[:-1] - X[start:stop].dot(w)[:, None]
+        if cumulative:
+            out[start:stop, :-1] = phi(a.ravel()).reshape(a.shape)
+            out[start:stop, -1] = 1.
+        else:
+            # log_logistic(t) = -log(phi(t))
+            log_p = -log_logistic(a.ravel()).reshape(a.shape)
+            log_q = -log_logistic(-a.ravel()).reshape(a.shape)
+            out[start:stop, 0] = np.exp(log_p[:, 0])
+            out[start:stop, 1:-1] = np.exp(log_p[:, 1:] + log_q[:, :-1] + log_gap)
+            out[start:stop, -1] = np.exp(log_q[:, -1])
+    return out
 
 def main():
     DOC = """
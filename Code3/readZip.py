@@ -1,4 +1,16 @@
 '''Get data from MS-Excel files, which are stored zipped on the Web.
+
+The archives are kept in "Data/downloads", and registered in the data
+registry (see dataRegistry.py): they are downloaded only once, and only if
+the network is enabled.
+
+Everything derived from an archive is cached in "Data/downloads/zipcache",
+under the SHA-256 of the archive, so that it becomes invalid as soon as the
+archive changes:
+- an index of its members, with the position of their local headers, so
+  that a member is extracted with a single seek, without reading the
+  central directory of the archive again;
+- the parsed DataFrames, keyed by (archive hash, member, sheet, skiprows).
 '''
 
 # Linked to text in: An Introduction to Statistics
@@ -8,36 +20,115 @@
 import pandas as pd
 
 # additional packages
-import urllib
+import hashlib
 import io
+import json
+import os
+import struct
 import zipfile
+import zlib
+
+import dataRegistry
 
-def getDataDobson(url, inFile):
-    '''Extract data from a zipped-archive'''
+# Local file header of a zip-archive, see the PKWARE APPNOTE (section 4.3.7)
+LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+LOCAL_HEADER_SIGNATURE = 0x04034b50
+
+def getDataDobson(url, inFile, allowNetwork=None, sheet='Sheet1', skiprows=2,
+                  cache=True):
+    '''Extract data from a zipped-archive
+
+    The archive is taken from the registry, and downloaded only if
+    "allowNetwork" (or the environment variable STATSINTRO_NETWORK) enables
+    the network. With "cache", the DataFrame is parsed only once.'''
 
     # get the zip-archive
-    GLM_archive = urllib.request.urlopen(url).read()
+    archive = dataRegistry.resolve(dataRegistry.findUrl(url), allowNetwork)
+    archiveHash = dataRegistry.fileHash(archive)
 
-    # make the archive available as a byte-stream
-    zipdata = io.BytesIO()
-    zipdata.write(GLM_archive)
+    key = json.dumps([archiveHash, inFile, sheet, skiprows])
+    frameFile = os.path.join(cacheDir(), 'frames',
+                             hashlib.sha256(key.encode('utf-8')).hexdigest() + '.pkl')
+    if cache and os.path.isfile(frameFile):
+        return pd.read_pickle(frameFile)
 
     # extract the requested file from the archive, as a pandas XLS-file
-    myzipfile = zipfile.ZipFile(zipdata)
-    xlsfile = myzipfile.open(inFile)
+    xlsfile = io.BytesIO(readMember(archive, inFile, archiveHash))
 
     # read the xls-file into Python, using Pandas, and return the extracted data
     xls = pd.ExcelFile(xlsfile)
-    df  = xls.parse('Sheet1', skiprows=2)
+    df  = xls.parse(sheet, skiprows=skiprows)
 
+    if cache:
+        _atomicWrite(frameFile, df.to_pickle)
     return df
 
+def cacheDir():
+    '''Directory of the member indices and parsed DataFrames'''
+    return os.path.join(dataRegistry.DATA_DIR, 'downloads', 'zipcache')
+
+def memberIndex(archive, archiveHash=None):
+    '''Members of an archive: name -> (offset of the local header, compression,
+    compressed size, size, CRC, flags), read from the central directory only once'''
+    if archiveHash is None:
+        archiveHash = dataRegistry.fileHash(archive)
+    indexFile = os.path.join(cacheDir(), archiveHash + '.index.json')
+    try:
+        with open(indexFile) as fh:
+            return json.load(fh)
+    except (IOError, ValueError):
+        pass
+    with zipfile.ZipFile(archive) as myzipfile:
+        index = dict((info.filename, [info.header_offset, info.compress_type,
+                                      info.compress_size, info.file_size,
+                                      info.CRC, info.flag_bits])
+                     for info in myzipfile.infolist())
+
+    def writeIndex(fileName):
+        with open(fileName, 'w') as fh:
+            json.dump(index, fh)
+    _atomicWrite(indexFile, writeIndex)
+    return index
+
+def readMember(archive, inFile, archiveHash=None):
+    '''Content of the member "inFile" of an archive, located with the index'''
+    index = memberIndex(archive, archiveHash)
+    if inFile not in index:
+        raise KeyError('There is no item named {0!r} in the archive'.format(inFile))
+    offset, method, compressSize, size, crc, flags = index[inFile]
+    if flags & 0x1 or method not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+        # encrypted, or compressed with bzip2/lzma: let zipfile handle it
+        with zipfile.ZipFile(archive) as myzipfile:
+            return myzipfile.read(inFile)
+
+    with open(archive, 'rb') as fh:
+        fh.seek(offset)
+        header = LOCAL_HEADER.unpack(fh.read(LOCAL_HEADER.size))
+        if header[0] != LOCAL_HEADER_SIGNATURE:
+            raise zipfile.BadZipFile('Bad local header for {0!r}'.format(inFile))
+        nameLength, extraLength = header[-2:]
+        fh.seek(nameLength + extraLength, os.SEEK_CUR)
+        data = fh.read(compressSize)
+    if method == zipfile.ZIP_DEFLATED:
+        data = zlib.decompress(data, -zlib.MAX_WBITS)
+    if len(data) != size or zlib.crc32(data) & 0xffffffff != crc:
+        raise zipfile.BadZipFile('Bad CRC-32 for {0!r}'.format(inFile))
+    return data
+
+def _atomicWrite(fileName, write):
+    '''Call write(tmpFile), and move the result to fileName'''
+    if not os.path.isdir(os.path.dirname(fileName)):
+        os.makedirs(os.path.dirname(fileName))
+    tmpFile = '{0}.{1}.tmp'.format(fileName, os.getpid())
+    write(tmpFile)
+    os.replace(tmpFile, fileName)
+
 if __name__ == '__main__':
     # Select archive (on the web) and the file in the archive
     url = 'http://cdn.crcpress.com/downloads/C9500/GLM_data.zip'
     inFile = r'GLM_data/Table 2.8 Waist loss.xls'
 
-    df = getDataDobson(url, inFile)
+    df = getDataDobson(url, inFile, allowNetwork=True)
     print(df)
 
     input('All done!')
@@ -14,6 +14,7 @@ import unittest
 import anovaOneway
 import anovaTwoway
 import bayesianStats
+import binaryTable
 import binomialTest
 import bootstrapDemo
 import checkNormality
@@ -46,6 +47,14 @@ import statsmodels_intro
 import survival
 import twoSample
 
+def _ologitData():
+    '''A small ordinal problem, and its fit with the default solver'''
+    rs = np.random.RandomState(0)
+    X = rs.randn(300, 3)
+    y = np.digitize(X.dot([1, -1, .5]) + rs.logistic(size=300), [-1, 0, 1.5])
+    w, theta = ologit.ordinal_logistic_fit(X, y, random_state=0)
+    return X, y, w, theta
+
 class TestSequenceFunctions(unittest.TestCase):
     def setUp(self):
         t = np.arange(0,10,0.1)
@@ -79,6 +88,27 @@ class TestSequenceFunctions(unittest.TestCase):
         self.assertAlmostEqual(linearTemperature[20][0], 63.51020408)
         self.assertAlmostEqual(mean_p[20], 0.573, places=1) 
 
+    def test_binaryTable(self):
+        data = binaryTable.loadTable('galton.csv', subDir=r'..\Data\data_kaplan')
+        inData = pd.read_csv('../Data/data_kaplan/galton.csv')
+        np.testing.assert_array_equal(data['height'], inData['height'])
+        np.testing.assert_array_equal(data['sex'].astype(str), inData['sex'])
+        
+        table = binaryTable.loadTable('galton.csv', subDir=r'..\Data\data_kaplan', asFrame=False)
+        self.assertIsInstance(table['height'], np.memmap)
+        self.assertEqual(list(table.values('sex', slice(0, 2))), ['M', 'F'])
+        
+        # tables with other options of pd.read_csv are kept side by side
+        import os, shutil, tempfile
+        tmpDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpDir)
+        shutil.copy('../Data/data_kaplan/galton.csv', tmpDir)
+        binaryTable.loadTable('galton.csv', subDir=tmpDir)
+        subset = binaryTable.loadTable('galton.csv', subDir=tmpDir, usecols=['height'])
+        self.assertEqual(list(subset.columns), ['height'])
+        cacheDir = os.path.join(tmpDir, '__npycache__')
+        self.assertEqual(len([name for name in os.listdir(cacheDir) if name.endswith('.cols')]), 2)
+        
     def test_binomialTest(self):
         p1,p2 = binomialTest.binomial_test(51)
         self.assertAlmostEqual(p1, 0.0265442457117)
@@ -103,6 +133,39 @@ class TestSequenceFunctions(unittest.TestCase):
         fisher = compGroups.fisherExact()
         self.assertAlmostEqual(fisher[1], 0.035, places=2)
         
+    def test_dataRegistry(self):
+        import os, pathlib, shutil, tempfile
+        import dataRegistry
+        entry = dict(dataRegistry.loadManifest()['data_altman/altman_93.txt'])
+        with open(dataRegistry.localPath(entry), 'rb') as fh:
+            content = fh.read()
+        
+        dataDir = dataRegistry.DATA_DIR
+        tmpDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpDir)
+        try:
+            dataRegistry.DATA_DIR = os.path.join(tmpDir, 'Data')
+            # a checkout with CRLF line ends (core.autocrlf on Windows) is valid
+            fileName = dataRegistry.localPath(entry)
+            os.makedirs(os.path.dirname(fileName))
+            with open(fileName, 'wb') as fh:
+                fh.write(content.replace(b'\n', b'\r\n'))
+            self.assertEqual(dataRegistry.resolve(entry, allowNetwork=False), fileName)
+            
+            # a file that has been changed is not overwritten by a download
+            with open(fileName, 'ab') as fh:
+                fh.write(b'1,2\r\n')
+            source = os.path.join(tmpDir, 'altman_93.txt')
+            with open(source, 'wb') as fh:
+                fh.write(content)
+            entry['url'] = pathlib.Path(source).as_uri()
+            downloaded = dataRegistry.resolve(entry, allowNetwork=True)
+            self.assertEqual(downloaded, dataRegistry.downloadPath(entry))
+            with open(fileName, 'rb') as fh:
+                self.assertTrue(fh.read().endswith(b'1,2\r\n'))
+        finally:
+            dataRegistry.DATA_DIR = dataDir
+        
     def test_figs_BasicPrinciples(self):
         figs_BasicPrinciples.main()
         
@@ -138,6 +201,32 @@ class TestSequenceFunctions(unittest.TestCase):
         data = getData('altman_93.txt', subDir='../Data/data_altman')
         self.assertEqual(data[0][0], 5260)
         
+        # text columns and mixed columns give the same as genfromtxt
+        from io import BytesIO
+        from getdata import parseText
+        for text in (b'id,sex,height\n1,M,73.2\n2,F,69.2\n', b'1,M,73.2\n2A,F,69.2\n'):
+            np.testing.assert_array_equal(parseText(BytesIO(text)),
+                                          np.genfromtxt(BytesIO(text), delimiter=','))
+        
+    def test_getdata_cache(self):
+        import os, shutil, tempfile
+        tmpDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpDir)
+        inFile = os.path.join(tmpDir, 'cacheTest.txt')
+        with open(inFile, 'w') as fh:
+            fh.write('1,2\n3,4\n')
+        data = getData('cacheTest.txt', subDir=tmpDir)
+        data = getData('cacheTest.txt', subDir=tmpDir)
+        self.assertEqual(type(data), np.ndarray)
+        data -= data.mean()     # the cached data can be changed in place
+        
+        # a changed file replaces its sidecar
+        with open(inFile, 'w') as fh:
+            fh.write('5,6\n7,8\n9,10\n')
+        data = getData('cacheTest.txt', subDir=tmpDir)
+        self.assertEqual(data[2][1], 10)
+        self.assertEqual(len(os.listdir(os.path.join(tmpDir, '__npycache__'))), 1)
+        
     def test_gettingStarted(self):
         gettingStarted.main()
         
@@ -192,6 +281,77 @@ class TestSequenceFunctions(unittest.TestCase):
     def test_ologit(self):
         out = ologit.main()
         self.assertAlmostEqual(out, 3.5623885918, places=5)
+
+    def test_ologit_hessp(self):
+        X, y, w, theta = _ologitData()
+        # solvers that use the Hessian-vector product find the same optimum
+        for solver in ('Newton-CG', 'trust-ncg'):
+            w_s, theta_s = ologit.ordinal_logistic_fit(X, y, solver=solver, random_state=0)
+            np.testing.assert_allclose(w_s, w, atol=1e-4)
+            np.testing.assert_allclose(theta_s, theta, atol=1e-4)
+
+    def test_ologit_weights(self):
+        X, y, w, theta = _ologitData()
+        # weights are frequencies, and collapsing duplicates does not change the fit
+        w_w, theta_w = ologit.ordinal_logistic_fit(X[:150], y[:150], random_state=0,
+                                                   sample_weight=2 * np.ones(150))
+        w_d, theta_d = ologit.ordinal_logistic_fit(np.vstack((X[:150], X[:150])),
+                                                   np.hstack((y[:150], y[:150])), random_state=0)
+        np.testing.assert_allclose(w_w, w_d, atol=1e-5)
+        np.testing.assert_allclose(theta_w, theta_d, atol=1e-5)
+        w_c, theta_c = ologit.ordinal_logistic_fit(np.round(X), y, collapse=True, random_state=0)
+        w_r, theta_r = ologit.ordinal_logistic_fit(np.round(X), y, random_state=0)
+        np.testing.assert_allclose(w_c, w_r, atol=1e-5)
+        np.testing.assert_allclose(theta_c, theta_r, atol=1e-5)
+
+    def test_ologit_predict(self):
+        X, y, w, theta = _ologitData()
+        # searchsorted gives the levels of the original argmax rule
+        thresholds = np.sort(np.unique(theta))
+        thresholds[-1] = np.inf
+        levels = np.argmax(X.dot(w)[:, None] < thresholds, axis=1)
+        np.testing.assert_array_equal(ologit.ordinal_logistic_predict(w, theta, X), levels)
+        proba = ologit.ordinal_logistic_predict_proba(w, theta, X, chunk_size=64)
+        np.testing.assert_allclose(proba.sum(axis=1), 1)
+        cumulative = ologit.ordinal_logistic_predict_proba(w, theta, X, cumulative=True)
+        np.testing.assert_allclose(cumulative, np.cumsum(proba, axis=1), atol=1e-12)
+
+    def test_ologit_cov(self):
+        X, y, w, theta = _ologitData()
+        # covariances of (w, theta)
+        cov = ologit.ordinal_logistic_fit(X, y, random_state=0, return_cov=True)[2]
+        for name in ('observed', 'sandwich'):
+            self.assertEqual(cov[name].shape, (w.size + theta.size,) * 2)
+            np.testing.assert_allclose(cov[name], cov[name].T, atol=1e-10)
+            self.assertTrue(np.all(np.diag(cov[name])[:w.size] > 0))
+        
+        w_b, theta_b, boot_w, boot_theta = ologit.ordinal_logistic_bootstrap(
+            X, y, n_boot=5, random_state=0)
+        np.testing.assert_allclose(w_b, w, atol=1e-4)
+        self.assertEqual(boot_w.shape, (5, w.size))
+        self.assertEqual(boot_theta.shape, (5, theta.size))
+        self.assertTrue(np.all(np.isfinite(boot_w)))
+
+    def test_ologit_path(self):
+        X, y, w, theta = _ologitData()
+        # the default ridge path ends close to the unpenalized fit
+        alphas, coefs, thetas = ologit.ordinal_logistic_path(X, y, random_state=0)
+        self.assertTrue(np.all(np.diff(alphas) < 0))
+        np.testing.assert_allclose(coefs[-1], w, atol=1e-3)
+        np.testing.assert_allclose(thetas[-1], theta, atol=1e-3)
+
+    def test_ologit_adam(self):
+        # rows sorted by y, as in ologit.main
+        rs = np.random.RandomState(0)
+        X = rs.randn(5000, 3) * [1, 10, .1] + [0, 5, 0]
+        y = np.digitize(X.dot([1, -.1, 5]) + rs.logistic(size=5000), [-1, 0, 1.5])
+        idx = np.argsort(y, kind='stable')
+        X, y = X[idx], y[idx]
+        w, theta = ologit.ordinal_logistic_fit(X, y, random_state=0)
+        w_adam, theta_adam = ologit.ordinal_logistic_fit(X, y, solver='adam',
+                                                         batch_size=256, random_state=0)
+        np.testing.assert_allclose(w_adam, w, atol=.05)
+        np.testing.assert_allclose(theta_adam, theta, atol=.05)
         
     def test_oneSample(self):
         p = oneSample.check_mean()
@@ -203,9 +363,38 @@ class TestSequenceFunctions(unittest.TestCase):
     def test_readZip(self):
         url = 'http://cdn.crcpress.com/downloads/C9500/GLM_data.zip'
         inFile = r'GLM_data/Table 2.8 Waist loss.xls'
-        df = readZip.getDataDobson(url, inFile)
+        df = readZip.getDataDobson(url, inFile, allowNetwork=True)
         
         self.assertAlmostEqual(df['after'][0], 97)
+
+    def test_readZip_cache(self):
+        # a local stand-in for the archive on the web, in a temporary registry
+        import os, pathlib, shutil, tempfile, zipfile
+        import dataRegistry
+        dataDir, manifest = dataRegistry.DATA_DIR, dataRegistry.MANIFEST
+        tmpDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpDir)
+        inFile = os.path.join(dataDir, 'data_others', 'sinc.txt')
+        archive = os.path.join(tmpDir, 'stand-in.zip')
+        with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as myzipfile:
+            myzipfile.write(inFile, 'data/sinc.txt')
+        try:
+            dataRegistry.DATA_DIR = os.path.join(tmpDir, 'Data')
+            dataRegistry.MANIFEST = os.path.join(dataRegistry.DATA_DIR, 'registry.json')
+            url = pathlib.Path(archive).as_uri()
+            self.assertRaises(IOError, dataRegistry.resolve, dataRegistry.findUrl(url), False)
+
+            local = dataRegistry.resolve(dataRegistry.findUrl(url), allowNetwork=True)
+            # the hash of the first download is not written to the manifest
+            self.assertFalse(os.path.exists(dataRegistry.MANIFEST))
+            os.remove(archive)
+            # the second time, the archive comes from the cache
+            local = dataRegistry.resolve(dataRegistry.findUrl(url), allowNetwork=False)
+            with open(inFile, 'rb') as fh:
+                self.assertEqual(readZip.readMember(local, 'data/sinc.txt'), fh.read())
+            self.assertIn('data/sinc.txt', readZip.memberIndex(local))
+        finally:
+            dataRegistry.DATA_DIR, dataRegistry.MANIFEST = dataDir, manifest
         
     def test_sampleSize(self):
         n1 = sampleSize.sampleSize_oneGroup(0.5)
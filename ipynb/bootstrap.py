@@ -7,7 +7,17 @@ https://github.com/cgevans/scikits-bootstrap
 from numpy.random import randint
 from scipy.stats import norm
 import numpy as np
+import concurrent.futures
+import itertools
+import os
+import time
 import warnings
+import zlib
+
+# Number of bootstrap samples drawn from each child of the SeedSequence, when
+# a random_state is given. Fixed, so that the results do not depend on how
+# the work is split up between processes.
+SEED_BLOCK_SIZE = 1000
 
 class InstabilityWarning(UserWarning):
     """Issued when results may be unstable."""
@@ -16,7 +26,7 @@ class InstabilityWarning(UserWarning):
 # On import, make sure that InstabilityWarnings are not filtered out.
 warnings.simplefilter('always',InstabilityWarning)
 
-def ci(data, statfunction=np.average, alpha=0.05, n_samples=10000, method='bca', output='lowhigh', epsilon=0.001, multi=None):
+def ci(data, statfunction=np.average, alpha=0.05, n_samples=10000, method='bca', output='lowhigh', epsilon=0.001, multi=None, batch_size=None, sampling='indexes', random_state=None, n_jobs=None, executor=None, jackknife_blocks=None, block_length=None, quantiles='exact', sketch_size=2000, subsample_size=0.5, sefunction=None, inner_samples=50, t_budget=None, timings=None):
     """
 Given a set of data ``data``, and a statistics function ``statfunction`` that
 applies to that data, computes the bootstrap confidence interval for
@@ -48,7 +58,7 @@ alpha: float or iterable, optional
 n_samples: float, optional
     The number of bootstrap samples to use (default=10000)
 method: string, optional
-    The method to use: one of 'pi', 'bca', or 'abc' (default='bca')
+    The method to use: one of 'pi', 'bca', 'abc', 'subsample' or 't' (default='bca')
 output: string, optional
     The format of the output. 'lowhigh' gives low and high confidence interval
     values. 'errorbar' gives transposed abs(value-confidence interval value) values
@@ -60,6 +70,94 @@ multi: boolean, optional
     If False, assume data is a single array. If True, assume data is a tuple/other
     iterable of arrays of the same length that should be sampled together. If None,
     decide based on whether the data is an actual tuple. (default=None)
+batch_size: int, optional
+    If given, the bootstrap indexes are drawn as (batch_size, N) matrices, and
+    ``statfunction`` is called once per batch with an ``axis=1`` keyword. It
+    then has to return one value per row, i.e. the statistic of each resample
+    (np.mean, np.median, np.var and np.average accept this). The memory
+    required is about batch_size*N times the size of a data point. The random
+    numbers are drawn in the same order as in the unbatched path, so for a
+    given seed the results are identical. (default=None, i.e. one call of
+    ``statfunction`` per bootstrap sample)
+
+    For the ABC method, batch_size perturbed weight vectors are evaluated at
+    once: ``statfunction`` then gets the data broadcast to shape
+    (batch_size, N, ...), weights of shape (batch_size, N), and ``axis=1``.
+sampling: string, optional
+    How the bootstrap samples are handed to ``statfunction``: 'indexes' passes
+    the resampled data points, 'counts' passes the original data together with
+    a ``weights=`` array, holding how often each data point occurs in the
+    bootstrap sample (the same contract as for the ABC method). 'counts'
+    avoids copying the data for every bootstrap sample, and requires a
+    statistic that interprets the weights as frequency weights, like
+    np.average. With ``batch_size``, the data are broadcast (without copying)
+    to shape (batch_size, N, ...), the weights have shape (batch_size, N), and
+    ``axis=1`` is passed as well.
+
+    For serially correlated data (time series), 'block' (moving blocks),
+    'circular' (circular blocks) and 'stationary' (blocks of geometrically
+    distributed length) resample whole blocks of consecutive data points, see
+    ``block_bootstrap_indexes`` and ``stationary_bootstrap_indexes``. They are
+    passed to ``statfunction`` like 'indexes'. (default='indexes')
+block_length: int, optional (only for block sampling)
+    The length of the blocks, or the mean block length for 'stationary',
+    between 1 and N. (default=None, i.e. round(N**(1/3)))
+quantiles: string, optional
+    'exact' keeps the values of the statistic for all bootstrap samples, and
+    selects the required order statistics with a partial sort. 'sketch' feeds
+    them into a ``QuantileSketch`` as they are computed, so that memory does
+    not grow with n_samples; the interval limits are then approximate, with a
+    rank error of the order of n_samples/sketch_size. (default='exact')
+sketch_size: int, optional
+    The capacity of each level of the quantile sketch. (default=2000)
+subsample_size: float or int, optional (only for subsampling method)
+    The size b < N of the subsamples, as for ``subsample_indexes``. The
+    interval is consistent if b -> infinity and b/N -> 0; for moderate N,
+    b = N/2 works well for smooth statistics, thanks to the finite
+    population correction. (default=0.5)
+sefunction: function, string or None, optional (only for bootstrap-t method)
+    How the standard error of the statistic is estimated, for the data and for
+    each bootstrap sample. A function (data) -> standard error is used
+    directly (with ``batch_size``, it is also passed ``axis=1``). 'jackknife'
+    uses the jackknife standard error, computed with ``jackknife_stat``;
+    'bootstrap' uses an inner bootstrap with inner_samples samples. None
+    chooses 'jackknife' for statistics in LOO_STATISTICS, and 'bootstrap'
+    otherwise. (default=None)
+inner_samples: int, optional (only for bootstrap-t method)
+    The number of samples of the inner bootstrap. (default=50)
+t_budget: int, optional (only for bootstrap-t method)
+    The maximum total number of evaluations of ``statfunction`` for the
+    standard errors of all bootstrap samples. It limits the number of inner
+    bootstrap samples, or the number of groups of the jackknife (for
+    statistics without closed-form jackknife values). (default=None, i.e. no
+    limit)
+timings: dict, optional
+    If given, it is filled with the wall-clock time in seconds spent on the
+    bootstrap samples ('resampling'), and for the bootstrap-t method with the
+    part of it spent on their standard errors ('inner'), and the number of
+    statistic evaluations for these ('inner_evaluations'). With n_jobs or an
+    executor, only the work done in this process is counted.
+random_state: int or numpy.random.SeedSequence, optional
+    If given, the bootstrap samples are drawn in blocks of SEED_BLOCK_SIZE,
+    each from its own numpy Generator, seeded with a child of
+    ``SeedSequence(random_state)``. The results are then reproducible, and
+    identical for any n_jobs/executor. If None, the global numpy random state
+    is used (and the samples are drawn in a single process). (default=None)
+n_jobs: int, optional
+    The number of processes used to evaluate the bootstrap samples; -1 uses
+    all CPUs. Requires ``random_state``, and ``statfunction`` must be
+    picklable (i.e. not a lambda). (default=None, i.e. a single process)
+executor: concurrent.futures.Executor, optional
+    An executor to use instead of a new process pool with n_jobs workers.
+    The samples are then split into n_jobs tasks (by default, one per CPU).
+    Requires ``random_state``. (default=None)
+jackknife_blocks: int, optional (only for BCa method)
+    The acceleration of the BCa method is computed from the jackknife values of
+    the statistic. For the statistics in LOO_STATISTICS these are computed in
+    closed form. For all others, the statistic has to be evaluated N times;
+    if jackknife_blocks is given, the data are instead split into that many
+    groups, and only the group-deleted values are evaluated (delete-d
+    jackknife). (default=None, i.e. the full leave-one-out jackknife)
     
 Returns
 -------
@@ -84,6 +182,14 @@ Calculation Methods
     smooth, and allow for weighting of individual points with a weights=
     parameter (note that np.average allows this). This is _much_ faster
     than all other methods for situations where it can be used.
+'subsample': Subsampling Interval (Politis & Romano 1994)
+    The statistic is evaluated on n_samples subsamples of size b < N, drawn
+    without replacement (see ``subsample_indexes_batched``), and the
+    distribution of sqrt(b/(1-b/N))*(stat_b - stat) is used as an estimate
+    of the distribution of sqrt(N)*(stat - true value); the factor 1-b/N
+    corrects for the sampling without replacement. This is consistent under
+    much weaker conditions than the bootstrap (e.g. for extreme values), if
+    b/N -> 0, but assumes a sqrt(N) convergence rate. The ``sampling`` option is ignored.
 
 Examples
 --------
@@ -123,40 +229,7 @@ Efron, An Introduction to the Bootstrap. Chapman & Hall 1993
 
     # Deal with ABC *now*, as it doesn't need samples.
     if method == 'abc':
-        n = tdata[0].shape[0]*1.0
-        nn = tdata[0].shape[0]
-
-        I = np.identity(nn)
-        ep = epsilon / n*1.0
-        p0 = np.repeat(1.0/n,nn)
-
-        t1 = np.zeros(nn); t2 = np.zeros(nn)
-        try:
-          t0 = statfunction(*tdata,weights=p0)
-        except TypeError as e:
-          raise TypeError("statfunction does not accept correct arguments for ABC ({0})".format(e.message))
-
-        # There MUST be a better way to do this!
-        for i in range(0,nn):
-            di = I[i] - p0
-            tp = statfunction(*tdata,weights=p0+ep*di)
-            tm = statfunction(*tdata,weights=p0-ep*di)
-            t1[i] = (tp-tm)/(2*ep)
-            t2[i] = (tp-2*t0+tm)/ep**2
-
-        sighat = np.sqrt(np.sum(t1**2))/n
-        a = (np.sum(t1**3))/(6*n**3*sighat**3)
-        delta = t1/(n**2*sighat)
-        cq = (statfunction(*tdata,weights=p0+ep*delta)-2*t0+statfunction(*tdata,weights=p0-ep*delta))/(2*sighat*ep**2)
-        bhat = np.sum(t2)/(2*n**2)
-        curv = bhat/sighat-cq
-        z0 = norm.ppf(2*norm.cdf(a)*norm.cdf(-curv))
-        Z = z0+norm.ppf(alphas)
-        za = Z/(1-a*Z)**2
-        # stan = t0 + sighat * norm.ppf(alphas)
-        abc = np.zeros_like(alphas)
-        for i in range(0,len(alphas)):
-            abc[i] = statfunction(*tdata,weights=p0+za[i]*delta)
+        abc = _abc(tdata, statfunction, alphas, epsilon, batch_size)
 
         if output == 'lowhigh':
             return abc
@@ -165,12 +238,70 @@ Efron, An Introduction to the Bootstrap. Chapman & Hall 1993
         else:
             raise ValueError("Output option {0} is not supported.".format(output))
 
-    # We don't need to generate actual samples; that would take more memory.
-    # Instead, we can generate just the indexes, and then apply the statfun
-    # to those indexes.
-    bootindexes = bootstrap_indexes( tdata[0], n_samples )
-    stat = np.array([statfunction(*(x[indexes] for x in tdata)) for indexes in bootindexes])
-    stat.sort(axis=0)
+    if sampling not in ('indexes', 'counts', 'block', 'circular', 'stationary'):
+        raise ValueError("Sampling option {0} is not supported.".format(sampling))
+
+    if quantiles not in ('exact', 'sketch'):
+        raise ValueError("Quantiles option {0} is not supported.".format(quantiles))
+
+    if method == 'subsample':
+        sampling = 'subsample'
+        if _subsample_size(tdata[0], subsample_size) >= tdata[0].shape[0]:
+            raise ValueError("The subsampling method requires subsamples smaller than the data.")
+    elif sampling in ('block', 'circular', 'stationary'):
+        _block_length(tdata[0].shape[0], block_length)
+
+    # The bootstrap-t method bootstraps the studentized statistic
+    if method == 't':
+        if sampling == 'counts':
+            raise ValueError("The bootstrap-t method does not support sampling='counts'.")
+        tstat = _StudentizedStat(tdata, statfunction, sefunction, n_samples, inner_samples, t_budget,
+                                 batch_size is not None, random_state)
+        ostat, sestat = tstat.ostat, tstat.sestat
+        tstat.reset()
+        bootfunction = tstat
+    else:
+        bootfunction = statfunction
+
+    if random_state is None:
+        if n_jobs not in (None, 1) or executor is not None:
+            raise ValueError("Parallel bootstrapping requires a random_state.")
+        chunks = _bootstrap_stat_chunks(tdata, bootfunction, n_samples, sampling, batch_size, block_length,
+                                        subsample_size)
+    else:
+        chunks = _bootstrap_stat_parallel(tdata, bootfunction, n_samples, sampling, batch_size, block_length,
+                                          subsample_size, random_state, n_jobs, executor)
+
+    if method in ('bca', 'subsample'):
+        # The value of the statistic function applied just to the actual data.
+        ostat = statfunction(*tdata)
+
+    if method == 'subsample':
+        # Work with the roots sqrt(b)*(stat_b - stat) of the subsamples. As
+        # they are drawn without replacement, their variance is reduced by
+        # the finite population correction 1 - b/N, which is divided out.
+        nn = tdata[0].shape[0]
+        bb = _subsample_size(tdata[0], subsample_size)
+        scale = np.sqrt(bb/(1 - bb/nn))
+        chunks = (scale*(chunk - ostat) for chunk in chunks)
+
+    start = time.time()
+    if quantiles == 'exact':
+        stat = np.concatenate(list(chunks))
+        if method == 'bca':
+            nbelow = np.sum(stat < ostat, axis=0)
+    else:
+        sketch = QuantileSketch(sketch_size)
+        nbelow = 0
+        for chunk in chunks:
+            sketch.update(chunk)
+            if method == 'bca':
+                nbelow = nbelow + np.sum(chunk < ostat, axis=0)
+    if timings is not None:
+        timings['resampling'] = time.time() - start
+        if method == 't':
+            timings['inner'] = bootfunction.inner_time
+            timings['inner_evaluations'] = bootfunction.evaluations
 
     # Percentile Interval Method
     if method == 'pi':
@@ -179,15 +310,11 @@ Efron, An Introduction to the Bootstrap. Chapman & Hall 1993
     # Bias-Corrected Accelerated Method
     elif method == 'bca':
 
-        # The value of the statistic function applied just to the actual data.
-        ostat = statfunction(*tdata)
-
         # The bias correction value.
-        z0 = norm.ppf( ( 1.0*np.sum(stat < ostat, axis=0)  ) / n_samples )
+        z0 = norm.ppf( ( 1.0*nbelow ) / n_samples )
 
         # Statistics of the jackknife distribution
-        jackindexes = jackknife_indexes(tdata[0])
-        jstat = [statfunction(*(x[indexes] for x in tdata)) for indexes in jackindexes]
+        jstat = jackknife_stat(tdata, statfunction, jackknife_blocks)
         jmean = np.mean(jstat,axis=0)
 
         # Acceleration value
@@ -197,6 +324,15 @@ Efron, An Introduction to the Bootstrap. Chapman & Hall 1993
 
         avals = norm.cdf(z0 + zs/(1-a*zs))
 
+    # Subsampling Interval Method: the limits for alpha are
+    # stat - (1-alpha) quantile of the roots / sqrt(N)
+    elif method == 'subsample':
+        avals = 1 - alphas
+
+    # Bootstrap-t Method: stat - (1-alpha) quantile of t * se
+    elif method == 't':
+        avals = 1 - alphas
+
     else:
         raise ValueError("Method {0} is not supported.".format(method))
 
@@ -207,20 +343,24 @@ Efron, An Introduction to the Bootstrap. Chapman & Hall 1993
     elif np.any(nvals<10) or np.any(nvals>=n_samples-10):
         warnings.warn("Some values used top 10 low/high samples; results may be unstable.", InstabilityWarning)
 
+    # Only the order statistics nvals are needed, so there is no need to sort
+    # the values of all bootstrap samples.
+    if quantiles == 'exact':
+        limits = order_statistics(stat, nvals)
+    else:
+        limits = sketch.order_statistics(nvals, n_samples)
+    if method == 'subsample':
+        limits = ostat - limits/np.sqrt(nn)
+    elif method == 't':
+        limits = ostat - limits*sestat
+
     if output == 'lowhigh':
-        if nvals.ndim == 1:
-            # All nvals are the same. Simple broadcasting
-            return stat[nvals]
-        else:
-            # Nvals are different for each data point. Not simple broadcasting.
-            # Each set of nvals along axis 0 corresponds to the data at the same
-            # point in other axes.
-            return stat[(nvals, np.indices(nvals.shape)[1:].squeeze())]
+        return limits
     elif output == 'errorbar':
         if nvals.ndim == 1:
-          return abs(statfunction(data)-stat[nvals])[np.newaxis].T
+          return abs(statfunction(data)-limits)[np.newaxis].T
         else:
-          return abs(statfunction(data)-stat[(nvals, np.indices(nvals.shape)[1:])])[np.newaxis].T
+          return abs(statfunction(data)-limits[np.newaxis])[np.newaxis].T
     else:
         raise ValueError("Output option {0} is not supported.".format(output))
     
@@ -228,7 +368,7 @@ Efron, An Introduction to the Bootstrap. Chapman & Hall 1993
 
 
 
-def ci_abc(data, stat=lambda x,y: np.average(x,weights=y), alpha=0.05, epsilon = 0.001):
+def ci_abc(data, stat=lambda x,y,axis=None: np.average(x,weights=y,axis=axis), alpha=0.05, epsilon = 0.001, batch_size=None):
     """
 .. note:: Deprecated. This functionality is now rolled into ci.
           
@@ -253,6 +393,10 @@ alpha: float or iterable, optional
     each desired percentile.
 epsilon: float
     The step size for finite difference calculations. (default=0.001)
+batch_size: int, optional
+    If given, the finite differences are evaluated for batch_size points at a
+    time, by calling ``stat`` with weights of shape (batch_size, N) and
+    ``axis=1``, as in ``ci``. (default=None)
 
 Returns
 -------
@@ -274,46 +418,634 @@ bootstrap R package: http://cran.r-project.org/web/packages/bootstrap/
     # but pandas seems much much slower and the indexes become a problem.
     data = np.array(data)
 
-    n = data.shape[0]*1.0
-    nn = data.shape[0]
+    abc = _abc((data,), lambda x, weights, **kwargs: stat(x, weights, **kwargs), alpha, epsilon, batch_size)
+
+    return abc
+
+class _StudentizedStat(object):
+    """
+The studentized statistic (stat(sample) - stat(data))/se(sample) of the
+bootstrap-t method, as a picklable statistic function that ``ci`` can
+bootstrap like any other (including batches, with axis=1). It also keeps
+track of the time and the number of statistic evaluations spent on the
+standard errors.
+
+With a random_state, the inner bootstrap of each sample is seeded from
+random_state and a checksum of the sample, so that the results do not depend
+on how the samples are split between processes.
+    """
+    def __init__(self, tdata, statfunction, sefunction, n_samples, inner_samples, budget, batched, random_state):
+        self.statfunction = statfunction
+        self.batched = batched
+        self.inner_samples = inner_samples
+        self.jackknife_blocks = None
+        if sefunction is None:
+            sefunction = 'jackknife' if statfunction in LOO_STATISTICS else 'bootstrap'
+        self.sefunction = sefunction
+        n = len(tdata[0])
+        if budget is not None:
+            if sefunction == 'bootstrap':
+                self.inner_samples = max(2, min(inner_samples, budget // n_samples))
+            elif sefunction == 'jackknife' and statfunction not in LOO_STATISTICS:
+                self.jackknife_blocks = max(2, min(n, budget // n_samples))
+        if random_state is None:
+            self.seed = None
+        else:
+            seedseq = random_state if isinstance(random_state, np.random.SeedSequence) \
+                else np.random.SeedSequence(random_state)
+            self.seed = int(seedseq.generate_state(1)[0])
+        self.reset()
+        self.ostat = statfunction(*tdata)
+        self.sestat = self.se(tdata)
+
+    def reset(self):
+        self.inner_time = 0.
+        self.evaluations = 0
+
+    def se(self, tdata):
+        """Standard error of the statistic for the data tdata."""
+        start = time.time()
+        if callable(self.sefunction):
+            se = self.sefunction(*tdata)
+            self.evaluations += 1
+        elif self.sefunction == 'jackknife':
+            jstat = jackknife_stat(tdata, self.statfunction, self.jackknife_blocks)
+            g = len(jstat)
+            se = np.sqrt((g-1.0)/g * np.sum((jstat - np.mean(jstat, axis=0))**2, axis=0))
+            self.evaluations += 0 if self.statfunction in LOO_STATISTICS else g
+        elif self.sefunction == 'bootstrap':
+            if self.seed is None:
+                rng = None
+            else:
+                rng = np.random.default_rng([self.seed, zlib.crc32(np.ascontiguousarray(tdata[0]).tobytes())])
+            if self.batched:
+                indexes = next(bootstrap_indexes_batched(tdata[0], self.inner_samples, self.inner_samples, rng))
+                stat = self.statfunction(*(x[indexes] for x in tdata), axis=1)
+            else:
+                stat = np.array([self.statfunction(*(x[indexes] for x in tdata))
+                                 for indexes in bootstrap_indexes(tdata[0], self.inner_samples, rng)])
+            se = np.std(stat, axis=0, ddof=1)
+            self.evaluations += self.inner_samples
+        else:
+            raise ValueError("Standard error option {0} is not supported.".format(self.sefunction))
+        self.inner_time += time.time() - start
+        return se
+
+    def __call__(self, *data, **kwargs):
+        stat = self.statfunction(*data, **kwargs)
+        if kwargs.get('axis') is None:
+            return (stat - self.ostat)/self.se(data)
+        if callable(self.sefunction):
+            start = time.time()
+            se = self.sefunction(*data, axis=1)
+            self.evaluations += len(stat)
+            self.inner_time += time.time() - start
+        else:
+            se = np.array([self.se(tuple(x[i] for x in data)) for i in range(len(stat))])
+        return (stat - self.ostat)/se
+
+def order_statistics(stat, nvals):
+    """
+Return the values of ``stat`` (shape (n_samples, ...)) at the sorted positions
+``nvals`` along axis 0, without sorting the whole array. ``stat`` is
+partitioned in place.
+
+nvals has shape (k,), or (k, ...) with different positions for each element
+of the statistic (as for BCa intervals of vector-valued statistics). In the
+latter case, stat is partitioned at the smallest and largest position of each
+of the k rows, and only the values between them are sorted.
+    """
+    if nvals.ndim == 1:
+        stat.partition(np.unique(nvals), axis=0)
+        return stat[nvals]
+    rows = nvals.reshape(len(nvals), -1)
+    low, high = rows.min(axis=1), rows.max(axis=1)
+    stat.partition(np.unique(np.concatenate((low, high))), axis=0)
+    for l, h in zip(low, high):
+        if h - l > 1:
+            stat[l+1:h] = np.sort(stat[l+1:h], axis=0)
+    return np.take_along_axis(stat, nvals, axis=0)
+
+class QuantileSketch(object):
+    """
+Approximate quantiles of a stream of (possibly vector-valued) values, in
+bounded memory. This is a simple deterministic variant of the KLL sketch:
+values enter level 0; whenever a level holds 2*size values, they are sorted
+(for each element separately) and every other one is moved to the next level,
+where each value stands for twice as many original ones. Memory is
+O(size*log2(n/size)) values, and the rank error is of the order of n/size.
+    """
+    def __init__(self, size=2000):
+        self.size = size
+        self.levels = []
+        self.offsets = []
+        self.count = 0
+
+    def update(self, values):
+        """Add an array of values, shape (n, ...), to the sketch."""
+        values = np.asarray(values)
+        self.count += len(values)
+        h = 0
+        while len(values):
+            if h == len(self.levels):
+                self.levels.append(values)
+                self.offsets.append(0)
+                break
+            level = np.concatenate((self.levels[h], values))
+            if len(level) < 2*self.size:
+                self.levels[h] = level
+                break
+            level.sort(axis=0)
+            # Keep the odd one out, and alternate the offset, which avoids a
+            # systematic bias towards low or high values.
+            keep = len(level) % 2
+            self.levels[h] = level[len(level)-keep:]
+            values = level[self.offsets[h] : len(level)-keep : 2]
+            self.offsets[h] = 1 - self.offsets[h]
+            h += 1
+        return self
+
+    def order_statistics(self, nvals, n=None):
+        """
+Approximate values at the sorted positions nvals (shape (k,) or (k, ...),
+as for ``order_statistics``) of the n values added so far.
+        """
+        n = self.count if n is None else n
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 2.0**h) for h, level in enumerate(self.levels)])
+        order = np.argsort(values, axis=0)
+        values = np.take_along_axis(values, order, axis=0)
+        cumweights = np.cumsum(weights[order], axis=0)
+        # Positions on the scale of the total weight
+        ranks = (np.asarray(nvals) + 0.5) * cumweights[-1] / n
+        limits = []
+        for rank in ranks:
+            first = np.argmax(cumweights > rank, axis=0)
+            limits.append(np.take_along_axis(values, first[np.newaxis], axis=0)[0]
+                          if values.ndim > 1 else values[first])
+        return np.array(limits)
+
+def ci_stream(chunks, statistic='mean', alpha=0.05, n_samples=1000, random_state=None, ddof=0):
+    """
+Given an iterable of data chunks ``chunks``, computes the percentile bootstrap
+confidence interval of ``statistic`` with the Poisson (online) bootstrap,
+without ever holding the full data in memory. Data points are delineated by
+axis 0 of each chunk.
+
+Parameters
+----------
+chunks: iterable of array_like, shape (n, ...) (or of tuples (x, y) for 'ols')
+    The data, in chunks of any size. Memory use is about n_samples*n for the
+    weights of a chunk, plus the state of the accumulators.
+statistic: string, optional
+    One of 'mean', 'proportion' (the mean of 0/1 data), 'var', 'cov' or 'ols'.
+    See ``PoissonBootstrap``. (default='mean')
+alpha: float or iterable, optional
+    The percentiles to use for the confidence interval, as for ``ci``.
+    (default=0.05)
+n_samples: int, optional
+    The number of bootstrap replicates (default=1000)
+random_state: int, numpy.random.SeedSequence or numpy Generator, optional
+    Seeds the Poisson weights. If None, the global numpy random state is used.
+    (default=None)
+ddof: int, optional
+    Delta degrees of freedom for 'var' and 'cov'. (default=0)
+
+Returns
+-------
+confidences: tuple of floats
+    The confidence percentiles specified by alpha
+
+Examples
+--------
+To calculate the confidence interval for the mean of a large text file:
+
+>> boot.ci_stream( chunk.values for chunk in pd.read_csv('data.csv', chunksize=100000) )
+
+References
+----------
+Hanley & MacGibbon, Creating non-parametric bootstrap samples using Poisson
+frequencies. Comput Methods Programs Biomed 83, 57-62 (2006)
+    """
+    boot = PoissonBootstrap(statistic, n_samples, random_state, ddof)
+    for chunk in chunks:
+        boot.update(chunk)
+    return boot.ci(alpha)
+
+class PoissonBootstrap(object):
+    """
+Online bootstrap with Poisson(1) weights. Each row of every chunk passed to
+``update`` enters each of the n_samples replicates with an independent
+Poisson(1) weight, which for large N approximates the multinomial counts of
+the ordinary bootstrap. Only mergeable sufficient statistics are stored per
+replicate, so the state does not grow with the number of data points:
+
+'mean', 'proportion': total weight and weighted mean, O(n_samples*p)
+'var': additionally the sum of squared deviations, O(n_samples*p)
+'cov': additionally the matrix of cross deviations, O(n_samples*p**2)
+'ols': X'WX and X'Wy of the regression of y on x with an intercept (chunks
+    are tuples (x, y)), O(n_samples*p**2)
+
+Means and deviations are combined with the pairwise update formula of Chan
+et al., which is numerically stable. Accumulators with the same statistic and
+n_samples, e.g. filled by different processes (with different seeds!), can be
+combined with ``merge``.
+    """
+    statistics = ('mean', 'proportion', 'var', 'cov', 'ols')
+
+    def __init__(self, statistic='mean', n_samples=1000, random_state=None, ddof=0):
+        if statistic not in self.statistics:
+            raise ValueError("Statistic {0} is not supported.".format(statistic))
+        self.statistic = statistic
+        self.n_samples = n_samples
+        self.ddof = ddof
+        if random_state is None or isinstance(random_state, np.random.Generator):
+            self.rng = random_state
+        else:
+            self.rng = np.random.default_rng(random_state)
+        self.shape = None
+        self.weight = np.zeros(n_samples)
+        self.mean = None
+        self.m2 = None
+
+    def update(self, chunk):
+        """Add a chunk of data points to all replicates."""
+        if self.statistic == 'ols':
+            x, y = chunk
+            X = _design(x)
+            y = np.asarray(y, dtype=float)
+            n = len(X)
+        else:
+            x = np.asarray(chunk, dtype=float)
+            n = len(x)
+            X = x.reshape(n, -1)
+        if n == 0:
+            return self
+        if self.shape is None:
+            self.shape = X.shape[1:] if self.statistic == 'ols' else x.shape[1:]
+        w = _poisson(self.rng, (self.n_samples, n))
+        wsum = w.sum(axis=1).astype(float)
+
+        if self.statistic == 'ols':
+            xtx = np.einsum('bn,ni,nj->bij', w, X, X)
+            xty = w.dot(y[:,np.newaxis]*X)
+            if self.mean is None:
+                self.mean, self.m2 = xty, xtx
+            else:
+                self.mean += xty
+                self.m2 += xtx
+            self.weight += wsum
+            return self
+
+        # Center on the (unweighted) chunk mean to keep the sums small
+        xbar = X.mean(axis=0)
+        Xc = X - xbar
+        s1 = w.dot(Xc)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(wsum[:,np.newaxis] > 0, s1/wsum[:,np.newaxis], 0.)
+        if self.statistic == 'cov':
+            m2 = np.einsum('bn,ni,nj->bij', w, Xc, Xc) - wsum[:,np.newaxis,np.newaxis]*mean[:,:,np.newaxis]*mean[:,np.newaxis,:]
+        elif self.statistic == 'var':
+            m2 = w.dot(Xc**2) - wsum[:,np.newaxis]*mean**2
+        else:
+            m2 = None
+        self._combine(wsum, mean + xbar, m2)
+        return self
+
+    def merge(self, other):
+        """Add the replicates of another PoissonBootstrap accumulator to this one."""
+        if other.statistic != self.statistic or other.n_samples != self.n_samples:
+            raise ValueError("Only accumulators with the same statistic and n_samples can be merged.")
+        if other.mean is None:
+            return self
+        if self.mean is None:
+            self.shape = other.shape
+            self.weight, self.mean = other.weight.copy(), other.mean.copy()
+            self.m2 = None if other.m2 is None else other.m2.copy()
+        elif self.statistic == 'ols':
+            self.weight += other.weight
+            self.mean += other.mean
+            self.m2 += other.m2
+        else:
+            self._combine(other.weight, other.mean, other.m2)
+        return self
+
+    def _combine(self, weight, mean, m2):
+        # Pairwise update of weight, mean and sum of squared deviations
+        if self.mean is None:
+            self.weight, self.mean, self.m2 = weight, mean, m2
+            return
+        total = self.weight + weight
+        with np.errstate(invalid='ignore', divide='ignore'):
+            frac = np.where(total > 0, weight/total, 0.)[:,np.newaxis]
+        delta = mean - self.mean
+        if self.statistic == 'cov':
+            self.m2 = self.m2 + m2 + (self.weight*frac[:,0])[:,np.newaxis,np.newaxis]*delta[:,:,np.newaxis]*delta[:,np.newaxis,:]
+        elif self.statistic == 'var':
+            self.m2 = self.m2 + m2 + (self.weight*frac[:,0])[:,np.newaxis]*delta**2
+        self.mean = self.mean + frac*delta
+        self.weight = total
+
+    def values(self):
+        """Return the array of the statistic for all replicates, shape (n_samples, ...)."""
+        if self.mean is None:
+            raise ValueError("No data have been added.")
+        if self.statistic == 'ols':
+            return np.linalg.solve(self.m2, self.mean[:,:,np.newaxis])[:,:,0]
+        if self.statistic == 'cov':
+            return self.m2 / (self.weight - self.ddof)[:,np.newaxis,np.newaxis]
+        if self.statistic == 'var':
+            stat = self.m2 / (self.weight - self.ddof)[:,np.newaxis]
+        else:
+            stat = self.mean
+        return stat.reshape((self.n_samples,)+self.shape)
+
+    def ci(self, alpha=0.05):
+        """Percentile interval of the replicates, see ``ci`` for alpha."""
+        if np.iterable(alpha):
+            alphas = np.array(alpha)
+        else:
+            alphas = np.array([alpha/2,1-alpha/2])
+        stat = np.sort(self.values(), axis=0)
+        nvals = np.round((self.n_samples-1)*alphas).astype('int')
+        return stat[nvals]
+
+def _abc(tdata, statfunction, alphas, epsilon, batch_size=None):
+    """
+Approximate bootstrap confidence (ABC) values for the weighted statistic
+``statfunction(*tdata, weights=...)``, see ``ci``.
+
+The finite differences along each point, p0 +- ep*(e_i - p0), are evaluated
+either one point at a time, reusing two weight vectors, or, with batch_size,
+as (batch_size, N) weight arrays. The N x N identity matrix is never formed.
+    """
+    n = tdata[0].shape[0]*1.0
+    nn = tdata[0].shape[0]
 
-    I = np.identity(nn)
     ep = epsilon / n*1.0
     p0 = np.repeat(1.0/n,nn)
 
     t1 = np.zeros(nn); t2 = np.zeros(nn)
-    t0 = stat(data,p0)
+    try:
+      t0 = statfunction(*tdata,weights=p0)
+    except TypeError as e:
+      raise TypeError("statfunction does not accept correct arguments for ABC ({0})".format(e))
 
-    # There MUST be a better way to do this!
-    for i in range(0,nn):
-        di = I[i] - p0
-        tp = stat(data,p0+ep*di)
-        tm = stat(data,p0-ep*di)
-        t1[i] = (tp-tm)/(2*ep)
-        t2[i] = (tp-2*t0+tm)/ep**2
+    # p0 +- ep*(e_i - p0) = (1 -+ ep)*p0 +- ep*e_i
+    if batch_size is None:
+        wp = (1-ep)*p0
+        wm = (1+ep)*p0
+        for i in range(0,nn):
+            wp[i] += ep; wm[i] -= ep
+            tp = statfunction(*tdata,weights=wp)
+            tm = statfunction(*tdata,weights=wm)
+            wp[i] = (1-ep)*p0[i]; wm[i] = (1+ep)*p0[i]
+            t1[i] = (tp-tm)/(2*ep)
+            t2[i] = (tp-2*t0+tm)/ep**2
+    else:
+        for start in range(0, nn, batch_size):
+            rows = np.arange(start, min(start+batch_size, nn))
+            wp = np.full((len(rows), nn), (1-ep)/n)
+            wm = np.full((len(rows), nn), (1+ep)/n)
+            wp[np.arange(len(rows)), rows] += ep
+            wm[np.arange(len(rows)), rows] -= ep
+            bdata = tuple(np.broadcast_to(x, (len(rows),)+x.shape) for x in tdata)
+            tp = statfunction(*bdata, weights=wp, axis=1)
+            tm = statfunction(*bdata, weights=wm, axis=1)
+            t1[rows] = (tp-tm)/(2*ep)
+            t2[rows] = (tp-2*t0+tm)/ep**2
 
     sighat = np.sqrt(np.sum(t1**2))/n
     a = (np.sum(t1**3))/(6*n**3*sighat**3)
     delta = t1/(n**2*sighat)
-    cq = (stat(data,p0+ep*delta)-2*t0+stat(data,p0-ep*delta))/(2*sighat*ep**2)
+    cq = (statfunction(*tdata,weights=p0+ep*delta)-2*t0+statfunction(*tdata,weights=p0-ep*delta))/(2*sighat*ep**2)
     bhat = np.sum(t2)/(2*n**2)
     curv = bhat/sighat-cq
     z0 = norm.ppf(2*norm.cdf(a)*norm.cdf(-curv))
-    Z = z0+norm.ppf(alpha)
+    Z = z0+norm.ppf(alphas)
     za = Z/(1-a*Z)**2
-    # stan = t0 + sighat * norm.ppf(alpha)
-    abc = np.zeros_like(alpha)
-    for i in range(0,len(alpha)):
-        abc[i] = stat(data,p0+za[i]*delta)
-
+    # stan = t0 + sighat * norm.ppf(alphas)
+    abc = np.zeros_like(alphas)
+    for i in range(0,len(alphas)):
+        abc[i] = statfunction(*tdata,weights=p0+za[i]*delta)
     return abc
 
-def bootstrap_indexes(data, n_samples=10000):
+def _bootstrap_stat(tdata, statfunction, n_samples, sampling, batch_size, block_length=None, subsample_size=None, rng=None):
+    """
+Apply ``statfunction`` to n_samples bootstrap samples of the tuple of arrays
+``tdata``, and return the (unsorted) array of the results. See ``ci`` for the
+meaning of ``sampling``, ``batch_size``, ``block_length`` and ``subsample_size``.
+``sampling`` may also be 'subsample', for the subsampling method.
+    """
+    return np.concatenate(list(_bootstrap_stat_chunks(tdata, statfunction, n_samples, sampling, batch_size,
+                                                      block_length, subsample_size, rng)))
+
+def _bootstrap_stat_chunks(tdata, statfunction, n_samples, sampling, batch_size, block_length=None, subsample_size=None, rng=None):
+    """
+Like ``_bootstrap_stat``, but return a generator of arrays with the results
+for batch_size (or, without batches, SEED_BLOCK_SIZE) samples at a time.
+    """
+    # We don't need to generate actual samples; that would take more memory.
+    # Instead, we can generate just the indexes, and then apply the statfun
+    # to those indexes.
+    if sampling == 'indexes':
+        if batch_size is None:
+            bootindexes = bootstrap_indexes( tdata[0], n_samples, rng )
+            return _chunked(statfunction(*(x[indexes] for x in tdata)) for indexes in bootindexes)
+        else:
+            bootindexes = bootstrap_indexes_batched( tdata[0], n_samples, batch_size, rng )
+            return (statfunction(*(x[indexes] for x in tdata), axis=1) for indexes in bootindexes)
+    elif sampling in ('block', 'circular', 'stationary', 'subsample'):
+        if sampling == 'subsample':
+            bootindexes = subsample_indexes_batched( tdata[0], n_samples, subsample_size, batch_size or 1000, rng )
+        elif sampling == 'stationary':
+            bootindexes = stationary_bootstrap_indexes( tdata[0], n_samples, block_length, batch_size or 1000, rng )
+        else:
+            bootindexes = block_bootstrap_indexes( tdata[0], n_samples, block_length, sampling == 'circular',
+                                                   batch_size or 1000, rng )
+        if batch_size is None:
+            return _chunked(statfunction(*(x[indexes] for x in tdata)) for batch in bootindexes for indexes in batch)
+        else:
+            return (statfunction(*(x[indexes] for x in tdata), axis=1) for indexes in bootindexes)
+    else:
+        bootcounts = bootstrap_counts( tdata[0], n_samples, batch_size, rng )
+        if batch_size is None:
+            return _chunked(statfunction(*tdata, weights=counts) for counts in bootcounts)
+        else:
+            return (statfunction(*(np.broadcast_to(x, counts.shape[:1]+x.shape) for x in tdata),
+                                 weights=counts, axis=1) for counts in bootcounts)
+
+def _chunked(values, size=SEED_BLOCK_SIZE):
+    """Collect the items of the iterable values into arrays of (up to) size items."""
+    values = iter(values)
+    while True:
+        chunk = list(itertools.islice(values, size))
+        if not chunk:
+            return
+        yield np.array(chunk)
+
+def _bootstrap_stat_blocks(tdata, statfunction, blocks, sampling, batch_size, block_length, subsample_size):
+    """
+Evaluate the bootstrap samples for a list of (seed, n_samples) blocks, each
+drawn from its own Generator. This runs in the worker processes.
+    """
+    return [_bootstrap_stat(tdata, statfunction, size, sampling, batch_size, block_length, subsample_size,
+                            np.random.default_rng(seed))
+            for seed, size in blocks]
+
+def _bootstrap_stat_parallel(tdata, statfunction, n_samples, sampling, batch_size, block_length, subsample_size,
+                             random_state, n_jobs, executor):
+    """
+Like ``_bootstrap_stat_chunks``, but with the samples split into blocks of
+SEED_BLOCK_SIZE, seeded from ``SeedSequence(random_state).spawn``, and
+evaluated by ``executor``, by a pool of n_jobs processes, or in this process.
+The results of the blocks are generated in order, so they do not depend on
+the number of workers.
+    """
+    if isinstance(random_state, np.random.SeedSequence):
+        seedseq = random_state
+    else:
+        seedseq = np.random.SeedSequence(random_state)
+    sizes = [min(SEED_BLOCK_SIZE, n_samples-start) for start in range(0, n_samples, SEED_BLOCK_SIZE)]
+    blocks = list(zip(seedseq.spawn(len(sizes)), sizes))
+
+    if executor is None and n_jobs in (None, 1):
+        for block in blocks:
+            yield _bootstrap_stat_blocks(tdata, statfunction, [block], sampling, batch_size, block_length,
+                                         subsample_size)[0]
+        return
+
+    # One task per worker, so that the data are pickled only once per worker.
+    # An executor does not tell its number of workers, so that is taken from
+    # n_jobs as well.
+    if n_jobs is None or n_jobs < 1:
+        n_jobs = os.cpu_count() or 1
+    tasks = [[blocks[i] for i in part] for part in np.array_split(np.arange(len(blocks)), min(n_jobs, len(blocks)))]
+    args = zip(*[(tdata, statfunction, task, sampling, batch_size, block_length, subsample_size)
+                 for task in tasks])
+    if executor is None:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=len(tasks)) as pool:
+            for result in pool.map(_bootstrap_stat_blocks, *args):
+                for stat in result:
+                    yield stat
+    else:
+        for result in executor.map(_bootstrap_stat_blocks, *args):
+            for stat in result:
+                yield stat
+
+def _randint(rng, high, size):
+    """Draw random integers from rng, or from the global random state if rng is None."""
+    if rng is None:
+        return randint(high, size=size)
+    return rng.integers(high, size=size)
+
+def _random(rng, size):
+    """Draw uniform random numbers in [0, 1) from rng, or from the global random state if rng is None."""
+    if rng is None:
+        return np.random.random_sample(size)
+    return rng.random(size)
+
+def _poisson(rng, size):
+    """Draw Poisson(1) weights from rng, or from the global random state if rng is None."""
+    if rng is None:
+        return np.random.poisson(1.0, size=size)
+    return rng.poisson(1.0, size=size)
+
+def bootstrap_indexes(data, n_samples=10000, rng=None):
+    """
+Given data points data, where axis 0 is considered to delineate points, return
+a list of arrays where each array is a set of bootstrap indexes. If a numpy
+Generator rng is given, it is used instead of the global random state.
+    """
+    return ( _randint(rng, data.shape[0], data.shape[0]) for a in range(0,n_samples) )
+
+def bootstrap_indexes_batched(data, n_samples=10000, batch_size=1000, rng=None):
+    """
+Given data points data, where axis 0 is considered to delineate points, return
+a generator of arrays with shape (batch_size, N), where each row is a set of
+bootstrap indexes. The last array holds the remaining rows, so that
+n_samples rows are returned in total.
+
+The indexes are drawn in the same order as by ``bootstrap_indexes``, i.e.
+stacking the rows gives the same indexes for the same random seed (or the same
+state of rng).
+    """
+    n = data.shape[0]
+    return ( _randint(rng, n, (min(batch_size, n_samples-start), n))
+             for start in range(0, n_samples, batch_size) )
+
+def bootstrap_counts(data, n_samples=10000, batch_size=None, rng=None):
+    """
+Given data points data, where axis 0 is considered to delineate points, return
+a generator of arrays with the number of times each data point occurs in a
+bootstrap sample, i.e. multinomial counts that sum to N. If batch_size is
+given, arrays of shape (batch_size, N) are returned, as in
+``bootstrap_indexes_batched``.
+
+The counts are obtained by binning the output of ``bootstrap_indexes``
+(``bootstrap_indexes_batched``), so for the same random seed (or rng) they
+describe exactly the same bootstrap samples.
+    """
+    n = data.shape[0]
+    if batch_size is None:
+        return ( np.bincount(indexes, minlength=n) for indexes in bootstrap_indexes(data, n_samples, rng) )
+    # Offset the indexes of each row, so that one bincount covers the batch
+    return ( np.bincount((indexes + n*np.arange(len(indexes))[:,np.newaxis]).ravel(),
+                         minlength=n*len(indexes)).reshape(len(indexes), n)
+             for indexes in bootstrap_indexes_batched(data, n_samples, batch_size, rng) )
+
+def block_bootstrap_indexes(data, n_samples=10000, block_length=None, circular=False, batch_size=1000, rng=None):
     """
 Given data points data, where axis 0 is considered to delineate points, return
-a list of arrays where each array is a set of bootstrap indexes.
+a generator of arrays with shape (batch_size, N), where each row is a set of
+moving-block bootstrap indexes: the concatenation of ceil(N/block_length)
+blocks of consecutive indexes with random starting points, truncated to N.
+
+If circular is True, the blocks wrap around the end of the data, so that all
+points are equally likely to be drawn (circular block bootstrap). The default
+block_length is round(N**(1/3)).
     """
-    return ( randint(data.shape[0],size=data.shape[0] ) for a in range(0,n_samples) )
+    n = data.shape[0]
+    block_length = _block_length(n, block_length)
+    n_blocks = -(-n // block_length)
+    high = n if circular else n - block_length + 1
+    offsets = np.arange(block_length)
+    for start in range(0, n_samples, batch_size):
+        size = min(batch_size, n_samples-start)
+        starts = _randint(rng, high, (size, n_blocks))
+        indexes = (starts[:,:,np.newaxis] + offsets).reshape(size, -1)[:,:n]
+        yield indexes % n if circular else indexes
+
+def stationary_bootstrap_indexes(data, n_samples=10000, block_length=None, batch_size=1000, rng=None):
+    """
+Given data points data, where axis 0 is considered to delineate points, return
+a generator of arrays with shape (batch_size, N), where each row is a set of
+stationary bootstrap indexes (Politis & Romano 1994): each index continues
+the block of the previous one (wrapping around the end of the data), except
+that with probability 1/block_length a new block starts at a random point.
+The block lengths are thus geometrically distributed with mean block_length
+(default round(N**(1/3))).
+    """
+    n = data.shape[0]
+    block_length = _block_length(n, block_length)
+    positions = np.arange(n)
+    for start in range(0, n_samples, batch_size):
+        size = min(batch_size, n_samples-start)
+        new_block = _random(rng, (size, n)) < 1.0/block_length
+        new_block[:,0] = True
+        starts = _randint(rng, n, (size, n))
+        # For each position, the position at which its block started
+        block_start = np.maximum.accumulate(np.where(new_block, positions, 0), axis=1)
+        yield (np.take_along_axis(starts, block_start, axis=1) + positions - block_start) % n
+
+def _block_length(n, block_length):
+    """The block length for N data points: round(N**(1/3)) by default."""
+    if block_length is None:
+        return max(1, int(round(n**(1./3))))
+    if not 1 <= block_length <= n:
+        raise ValueError("block_length must be between 1 and the number of data points ({0}), "
+                         "not {1}.".format(n, block_length))
+    return block_length
 
 def jackknife_indexes(data):
     """
@@ -326,7 +1058,96 @@ Y with the ith data point deleted.
     base = np.arange(0,len(data))
     return (np.delete(base,i) for i in base)
 
-def subsample_indexes(data, n_samples=1000, size=0.5):
+def jackknife_stat(tdata, statfunction, blocks=None):
+    """
+Given a tuple of arrays tdata, where axis 0 is considered to delineate points,
+return the array of jackknife values of ``statfunction``, i.e. of the
+statistic applied to the data with one point deleted.
+
+For statistics listed in LOO_STATISTICS, the leave-one-out values are computed
+in closed form, in a single vectorized pass. For all other statistics, if
+blocks is given and smaller than N, the points are assigned to ``blocks``
+interleaved groups (point i belongs to group i % blocks), and the values for
+the data with one group deleted are returned (grouped or delete-d jackknife).
+Otherwise, the statistic is evaluated N times.
+    """
+    n = len(tdata[0])
+    if statfunction in LOO_STATISTICS:
+        return LOO_STATISTICS[statfunction](*tdata)
+    if blocks is None or blocks >= n:
+        return np.array([statfunction(*(x[indexes] for x in tdata)) for indexes in jackknife_indexes(tdata[0])])
+    groups = np.arange(n) % blocks
+    return np.array([statfunction(*(x[groups != g] for x in tdata)) for g in range(blocks)])
+
+def ols(x, y, weights=None):
+    """
+Ordinary (or, with weights, weighted) least squares fit of y on x, including
+an intercept. x has shape (N,) or (N, p), and the coefficients
+[intercept, slope(s)] are returned. Its jackknife values are computed in
+closed form, so it is well suited for BCa intervals of regression
+coefficients.
+    """
+    X = _design(x)
+    if weights is None:
+        return np.linalg.lstsq(X, y, rcond=None)[0]
+    sw = np.sqrt(weights)
+    return np.linalg.lstsq(X*sw[:,np.newaxis], y*sw, rcond=None)[0]
+
+def _design(x):
+    """Design matrix with a leading column of ones."""
+    x = np.asarray(x, dtype=float)
+    return np.column_stack((np.ones(len(x)), x.reshape(len(x), -1)))
+
+def _loo_sum(x):
+    # Like the statistics themselves, these reduce over all elements of a
+    # data point, so the leave-one-out values drop whole rows.
+    rows = np.reshape(x, (len(x), -1))
+    return np.sum(rows) - np.sum(rows, axis=1)
+
+def _loo_mean(x):
+    rows = np.reshape(x, (len(x), -1))
+    return _loo_sum(x) / (rows.size - rows.shape[1])
+
+def _loo_var(x):
+    # Downdate mean and sum of squared deviations with the pairwise update
+    # formula (Chan et al.), which avoids the cancellation of the raw
+    # second moment.
+    rows = np.reshape(x, (len(x), -1))
+    n, k = rows.size, rows.shape[1]
+    m = np.mean(rows)
+    m2 = np.sum((rows - m)**2)
+    g = np.mean(rows, axis=1)
+    g2 = np.sum((rows - g[:,np.newaxis])**2, axis=1)
+    m_loo = (n*m - k*g) / (n - k)
+    return (m2 - g2 - (g - m_loo)**2 * k*(n - k)/n) / (n - k)
+
+def _loo_std(x):
+    return np.sqrt(_loo_var(x))
+
+def _loo_ols(x, y):
+    # Rank-one downdate of the normal equations: deleting point i changes the
+    # coefficients by -(X'X)^-1 x_i e_i / (1 - h_i).
+    X = _design(x)
+    beta, _, _, _ = np.linalg.lstsq(X, y, rcond=None)
+    A = X.dot(np.linalg.pinv(X.T.dot(X)))
+    h = np.sum(A*X, axis=1)
+    e = y - X.dot(beta)
+    return beta - A * (e/(1 - h))[:,np.newaxis]
+
+# Statistics for which jackknife_stat uses closed-form leave-one-out values.
+# They must be called with their default arguments, i.e. reduce over all
+# elements of a single data array (ols: over the tuple (x, y)). Further entries map a statistic to a function
+# that takes the data and returns the (N, ...) array of jackknife values.
+LOO_STATISTICS = {
+    np.sum: _loo_sum,
+    np.mean: _loo_mean,
+    np.average: _loo_mean,
+    np.var: _loo_var,
+    np.std: _loo_std,
+    ols: _loo_ols,
+}
+
+def subsample_indexes(data, n_samples=1000, size=0.5, rng=None):
     """
 Given data points data, where axis 0 is considered to delineate points, return
 a list of arrays where each array is indexes a subsample of the data of size
@@ -335,15 +1156,38 @@ size < 1, it will be taken to be a fraction of the data size. If size == -1, it
 will be taken to mean subsamples the same size as the sample (ie, permuted
 samples)
     """
+    return np.concatenate(list(subsample_indexes_batched(data, n_samples, size, rng=rng)))
+
+def subsample_indexes_batched(data, n_samples=1000, size=0.5, batch_size=1000, rng=None):
+    """
+Given data points data, where axis 0 is considered to delineate points, return
+a generator of arrays with shape (batch_size, size), where each row indexes a
+subsample of the data drawn without replacement, in random order. See
+``subsample_indexes`` for the meaning of size.
+
+Each row gets N random keys; the indexes of the ``size`` smallest keys are
+selected with a partial sort (argpartition), which is O(N) per row, and then
+ordered by their keys.
+    """
+    n = len(data)
+    size = _subsample_size(data, size)
+    for start in range(0, n_samples, batch_size):
+        keys = _random(rng, (min(batch_size, n_samples-start), n))
+        if size < n:
+            indexes = np.argpartition(keys, size-1, axis=1)[:,:size]
+            keys = np.take_along_axis(keys, indexes, axis=1)
+            yield np.take_along_axis(indexes, np.argsort(keys, axis=1), axis=1)
+        else:
+            yield np.argsort(keys, axis=1)
+
+def _subsample_size(data, size):
+    """The absolute subsample size, see ``subsample_indexes``."""
     if size == -1:
         size = len(data)
     elif (size < 1) and (size > 0):
-        size = round(size*len(data))
+        size = int(round(size*len(data)))
     elif size > 1:
         pass
     else:
         raise ValueError("size cannot be {0}".format(size))
-    base = np.tile(np.arange(len(data)),(n_samples,1))
-    for sample in base: np.random.shuffle(sample)
-    return base[:,0:size]
-
+    return size
@@ -0,0 +1,102 @@
+''' Test routine for bootstrap.py
+
+'''
+
+# Import standard packages
+import numpy as np
+import concurrent.futures
+import scipy.stats
+
+# additional packages
+import unittest
+
+import bootstrap
+
+class TestBootstrap(unittest.TestCase):
+    def setUp(self):
+        rs = np.random.RandomState(0)
+        self.data = rs.randn(50)
+
+    def test_ci_batched(self):
+        # the batches draw the same indexes as the unbatched path
+        for method in ('pi', 'bca'):
+            np.random.seed(1)
+            ci = bootstrap.ci(self.data, np.mean, n_samples=2500, method=method)
+            np.random.seed(1)
+            ci_batched = bootstrap.ci(self.data, np.mean, n_samples=2500, method=method, batch_size=300)
+            np.testing.assert_allclose(ci_batched, ci, rtol=1e-12)
+
+            ci = bootstrap.ci(self.data, np.mean, n_samples=2500, method=method, random_state=2)
+            ci_batched = bootstrap.ci(self.data, np.mean, n_samples=2500, method=method, random_state=2,
+                                      batch_size=300)
+            np.testing.assert_allclose(ci_batched, ci, rtol=1e-12)
+
+    def test_ci_parallel(self):
+        # the samples are seeded per block, independent of the workers
+        kwargs = dict(n_samples=3500, method='bca', random_state=3)
+        ci = bootstrap.ci(self.data, np.mean, n_jobs=1, **kwargs)
+        np.testing.assert_array_equal(bootstrap.ci(self.data, np.mean, n_jobs=2, **kwargs), ci)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+            np.testing.assert_array_equal(bootstrap.ci(self.data, np.mean, executor=executor, **kwargs), ci)
+            np.testing.assert_array_equal(bootstrap.ci(self.data, np.mean, executor=executor, n_jobs=2, **kwargs),
+                                          ci)
+
+    def test_ci_counts(self):
+        # the counts are binned from the same indexes
+        for batch_size in (None, 300):
+            np.random.seed(4)
+            ci = bootstrap.ci(self.data, np.average, n_samples=1500, batch_size=batch_size)
+            np.random.seed(4)
+            ci_counts = bootstrap.ci(self.data, np.average, n_samples=1500, batch_size=batch_size,
+                                     sampling='counts')
+            np.testing.assert_allclose(ci_counts, ci, rtol=1e-12)
+
+    def test_jackknife_stat(self):
+        rs = np.random.RandomState(5)
+        x = rs.randn(30, 2)
+        y = x.dot([1., -2.]) + rs.randn(30)
+        for statfunction in (np.sum, np.mean, np.average, np.var, np.std):
+            loo = np.array([statfunction(np.delete(x, i, axis=0)) for i in range(len(x))])
+            np.testing.assert_allclose(bootstrap.jackknife_stat((x,), statfunction), loo, rtol=1e-10)
+        loo = np.array([bootstrap.ols(np.delete(x, i, axis=0), np.delete(y, i)) for i in range(len(x))])
+        np.testing.assert_allclose(bootstrap.jackknife_stat((x, y), bootstrap.ols), loo, rtol=1e-10)
+
+    def test_ci_t(self):
+        # the budget bounds the evaluations for the standard errors
+        trim_mean = lambda x: scipy.stats.trim_mean(x, 0.1)
+        for sefunction in ('bootstrap', 'jackknife'):
+            timings = {}
+            ci = bootstrap.ci(self.data, trim_mean, n_samples=1000, method='t', sefunction=sefunction,
+                              t_budget=10000, random_state=6, timings=timings)
+            self.assertTrue(ci[0] < trim_mean(self.data) < ci[1])
+            self.assertEqual(timings['inner_evaluations'], 10000)
+
+    def test_subsample_indexes_batched(self):
+        batches = list(bootstrap.subsample_indexes_batched(self.data, n_samples=250, size=20, batch_size=100,
+                                                           rng=np.random.default_rng(7)))
+        self.assertEqual([len(batch) for batch in batches], [100, 100, 50])
+        for row in np.concatenate(batches):
+            self.assertEqual(len(np.unique(row)), 20)
+            self.assertTrue(0 <= row.min() and row.max() < len(self.data))
+
+    def test_poisson_merge(self):
+        # merged accumulators equal one accumulator that sees both chunks,
+        # with the same weights
+        rs = np.random.RandomState(8)
+        x = rs.randn(200, 2)
+        y = x.dot([1., -2.]) + rs.randn(200)
+        for statistic in bootstrap.PoissonBootstrap.statistics:
+            chunks = [(x[:120], y[:120]), (x[120:], y[120:])] if statistic == 'ols' else [x[:120], x[120:]]
+            first = bootstrap.PoissonBootstrap(statistic, n_samples=100, random_state=1).update(chunks[0])
+            second = bootstrap.PoissonBootstrap(statistic, n_samples=100, random_state=2).update(chunks[1])
+            combined = bootstrap.PoissonBootstrap(statistic, n_samples=100, random_state=1).update(chunks[0])
+            combined.rng = np.random.default_rng(2)
+            combined.update(chunks[1])
+            merged = bootstrap.PoissonBootstrap(statistic, n_samples=100).merge(first).merge(second)
+            np.testing.assert_allclose(merged.values(), combined.values(), rtol=1e-10)
+
+        with self.assertRaises(ValueError):
+            bootstrap.PoissonBootstrap('mean', n_samples=100).merge(bootstrap.PoissonBootstrap('var', n_samples=100))
+
+if __name__ == '__main__':
+    unittest.main()